@@ -0,0 +1,92 @@
+"""
+Compare the collections lookups of one request: boolean-mask scans over the whole
+dataframe (the path before the hierarchy index) against the Hierarchy index built
+once per snapshot.
+
+  - scan:  self, parent, children and siblings found with == masks on the id and
+           parentIdentifier columns, four to five full-column scans per request
+  - index: id -> row position and parent -> sorted children slice lookups
+
+Usage: python benchmarks/collections_hierarchy.py [rows ...]
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'collections'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import make_geocore_df
+from hierarchy import Hierarchy
+from geocore_common.dtypes import optimize_dtypes
+
+DEFAULT_ROWS = [10000, 100000]
+LOOKUPS = 200
+ID = 'features_properties_id'
+PARENT = 'features_properties_parentIdentifier'
+TITLES = ['features_properties_title_en', 'features_properties_title_fr']
+
+def scan_lookup(geocore_df, uuid):
+    self_df = geocore_df[geocore_df[ID] == uuid]
+    if len(self_df) == 0:
+        return None
+    self_titles = self_df.iloc[0][TITLES].tolist()
+    parent_id = self_df.iloc[0][PARENT]
+    parent_df = geocore_df[geocore_df[ID] == parent_id]
+    children = geocore_df[geocore_df[PARENT] == uuid]
+    children = children[children[ID] != uuid]
+    siblings = geocore_df[geocore_df[PARENT] == parent_id]
+    siblings = siblings[siblings[ID] != uuid]
+    return self_titles, len(parent_df), len(children), len(siblings)
+
+def index_lookup(hierarchy, uuid):
+    position = hierarchy.position(uuid)
+    if position is None:
+        return None
+    self_titles = [hierarchy.values(column, [position])[0] for column in TITLES]
+    parent_id = hierarchy.parents[position]
+    parent_position = hierarchy.id_index.get(parent_id) if isinstance(parent_id, str) else None
+    children = hierarchy.child_page(uuid, limit=0, exclude=uuid)[1]
+    siblings = hierarchy.child_page(parent_id, limit=0, exclude=uuid)[1] if isinstance(parent_id, str) else 0
+    return self_titles, int(parent_position is not None), children, siblings
+
+def median_ms(func, ids):
+    samples = []
+    for uuid in ids:
+        start = time.perf_counter()
+        func(uuid)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main(row_counts):
+    print("%8s %12s %12s %14s %12s %10s" % ("rows", "build (s)", "index (MB)", "scan (ms)", "index (ms)", "speedup"))
+    for rows in row_counts:
+        df = optimize_dtypes(make_geocore_df(rows), report=False)
+
+        #children and records with a parent exercise every branch
+        with_parent = df[df[PARENT].notna()][ID].tolist()
+        ids = random.sample(with_parent, min(LOOKUPS // 2, len(with_parent))) + random.sample(df[ID].tolist(), LOOKUPS // 2)
+
+        start = time.perf_counter()
+        hierarchy = Hierarchy(df)
+        build_s = time.perf_counter() - start
+
+        #tracing slows the build down, measure its memory with a second build
+        tracemalloc.start()
+        traced = Hierarchy(df)
+        index_mb = tracemalloc.get_traced_memory()[0] / 1e6
+        tracemalloc.stop()
+        del traced
+
+        for uuid in ids[:20]:
+            assert scan_lookup(df, uuid) == index_lookup(hierarchy, uuid), uuid
+
+        scan = median_ms(lambda uuid: scan_lookup(df, uuid), ids)
+        index = median_ms(lambda uuid: index_lookup(hierarchy, uuid), ids)
+        print("%8d %12.3f %12.1f %14.3f %12.4f %9.0fx" % (rows, build_s, index_mb, scan, index, scan / index))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
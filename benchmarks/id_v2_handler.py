@@ -0,0 +1,332 @@
+"""
+End-to-end latency of the id_v2 lambda_handler against local stand-ins for S3 and OpenSearch.
+
+A synthetic parquet snapshot with the geocore column schema is written once per row count
+(and reused by later runs). Each row count then runs in its own process, so the cold start
+includes importing the handler and peak RSS is per run:
+
+  - cold:      import app + first request (snapshot load, index build, one miss)
+  - miss:      requests for distinct ids, each built from the snapshot
+  - hit:       the same ids again, served from the response cache
+  - not_found: random ids that are not in the snapshot
+  - batch:     ?ids= requests of --batch-size ids not requested before
+
+S3 reads are served from the local parquet and OpenSearch calls return canned responses
+after --os-latency-ms. Per-phase timings wrap the functions the handler calls.
+
+Usage: python benchmarks/id_v2_handler.py --rows 10000 100000 --output before.json
+       python benchmarks/id_v2_handler.py --rows 10000 --env MATERIALIZE_MODE=dict --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import platform
+import resource
+import argparse
+import tempfile
+import functools
+import subprocess
+import statistics
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+#environment the handler reads at import, --env overrides it
+HANDLER_ENV = {
+    'PARQUET_BUCKET_NAME': 's3://benchmark/geocore/',
+    'CACHE_EXPIRY_IN_DAYS': '1',
+    'OS_ENDPOINT': 'localhost',
+    'NEW_INDEX_NAME': 'benchmark',
+    'SNAPSHOT_CHECK_SECONDS': '0',
+    'LOCAL_SNAPSHOT_CACHE': 'false',
+    'AWS_DEFAULT_REGION': 'ca-central-1'
+}
+
+CHUNK_ROWS = 100000
+
+def write_parquet(rows, seed, data_dir):
+    """
+    Write a synthetic snapshot of rows records, in chunks so 1M rows fit in memory
+    :return path: the parquet file, reused if it already exists
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    from synthetic import make_geocore_df
+
+    path = os.path.join(data_dir, 'geocore_%d_%d.parquet' % (rows, seed))
+    if os.path.exists(path):
+        return path
+
+    os.makedirs(data_dir, exist_ok=True)
+    print("Writing", rows, "synthetic records to", path)
+    writer = None
+    for chunk, start in enumerate(range(0, rows, CHUNK_ROWS)):
+        table = pa.Table.from_pandas(make_geocore_df(min(CHUNK_ROWS, rows - start), seed=seed + chunk), preserve_index=False)
+        if writer is None:
+            writer = pq.ParquetWriter(path + '.tmp', table.schema)
+        writer.write_table(table)
+    writer.close()
+    os.replace(path + '.tmp', path)
+    return path
+
+class FakeTransport:
+    def __init__(self, latency):
+        self.latency = latency
+
+    def perform_request(self, method, url, body=None):
+        time.sleep(self.latency)
+        docs = json.loads(body).get('docs', [])
+        return {"docs": [{"doc": {"_source": {"ip2geo": {"country_name": "Canada", "location": "45.42,-75.69"}}}} for _ in docs]}
+
+class FakeIndices:
+    def exists(self, index):
+        return True
+
+    def create(self, index, body):
+        return {"acknowledged": True}
+
+class FakeOpenSearch:
+    """
+    Canned responses for the calls made by stats.py and dashboard.py
+    """
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.transport = FakeTransport(latency)
+        self.indices = FakeIndices()
+        self.calls = 0
+
+    def _wait(self):
+        self.calls += 1
+        time.sleep(self.latency)
+
+    def msearch(self, body):
+        self._wait()
+        return {"responses": [{"hits": {"total": {"value": 3}}}, {"hits": {"total": {"value": 9}}}]}
+
+    def search(self, index, body):
+        self._wait()
+        try:
+            ids = body["query"]["bool"]["filter"][0]["terms"]["id"]
+        except (KeyError, IndexError, TypeError):
+            ids = []
+        return {"aggregations": {"ids": {"buckets": [{"key": i, "doc_count": 9, "last_30_days": {"doc_count": 3}} for i in ids]}}}
+
+    def bulk(self, body):
+        self._wait()
+        return {"errors": False, "items": []}
+
+    def index(self, index, body):
+        self._wait()
+        return {"result": "created"}
+
+def percentiles(samples):
+    if not samples:
+        return {}
+    if len(samples) == 1:
+        cuts = samples * 99
+    else:
+        cuts = statistics.quantiles(samples, n=100, method='inclusive')
+    return {
+        "count": len(samples),
+        "mean_ms": round(statistics.fmean(samples), 3),
+        "p50_ms": round(cuts[49], 3),
+        "p95_ms": round(cuts[94], 3),
+        "p99_ms": round(cuts[98], 3),
+        "max_ms": round(max(samples), 3)
+    }
+
+def timed(phases, name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            phases.setdefault(name, []).append((time.perf_counter() - start) * 1000)
+    return wrapper
+
+def run_worker(args):
+    """
+    Drive the handler through every scenario for one parquet file and write the result JSON
+    """
+    os.environ.update(HANDLER_ENV)
+    os.environ['LOCAL_SNAPSHOT_DIR'] = os.path.join(args.data_dir, 'local_snapshots')
+    for override in args.env:
+        key, value = override.split('=', 1)
+        os.environ[key] = value
+    sys.path[:0] = [os.path.join(REPO_DIR, 'id_v2'), REPO_DIR]
+
+    #a cold start imports pandas, pyarrow, awswrangler and opensearch-py through the handler
+    start = time.perf_counter()
+    import app
+    import_ms = (time.perf_counter() - start) * 1000
+
+    import pandas as pd
+    import pyarrow.parquet as pq
+    import awswrangler as wr
+    import dashboard
+    import geocore_common.refresh as refresh
+
+    parquet_path = args.parquet
+    ids = pq.read_table(parquet_path, columns=['features_properties_id']).column(0).to_pylist()
+    rng = random.Random(args.seed)
+    needed = 1 + args.requests + args.batch_requests * args.batch_size
+    sample = rng.sample(ids, min(needed, len(ids)))
+    cold_id, miss_ids, batch_ids = sample[0], sample[1:1 + args.requests], sample[1 + args.requests:]
+
+    #synthetic ids come from seeded generators too, make sure these are really unknown
+    known = set(ids)
+    unknown_ids = []
+    while len(unknown_ids) < len(miss_ids):
+        candidate = str(uuid.UUID(int=rng.getrandbits(128), version=4))
+        if candidate not in known:
+            unknown_ids.append(candidate)
+    del ids, known
+
+    client = FakeOpenSearch(args.os_latency_ms / 1000.0)
+    phases = {}
+
+    #stand-ins for S3 and OpenSearch, installed before the first request loads the snapshot
+    stat = os.stat(parquet_path)
+    wr.s3.read_parquet = lambda path=None, **kwargs: pd.read_parquet(parquet_path)
+    refresh.object_signature = lambda path, region=None: ((parquet_path, str(stat.st_size), str(stat.st_mtime)),)
+    dashboard.connect_to_opensearch = lambda *a: client
+    app.connect_to_opensearch = lambda *a: client
+    for name in ('read_snapshot', 'build_snapshot', 'materialize_items',
+                 'find_items', 'add_to_cache', 'finish_invocation'):
+        setattr(app, name, timed(phases, name, getattr(app, name)))
+    app.refresher.loader = timed(phases, 'load_snapshot', app.refresher.loader)
+    app.stats_provider.get = timed(phases, 'stats', app.stats_provider.get)
+    app.stats_provider.get_many = timed(phases, 'stats', app.stats_provider.get_many)
+    app.telemetry.flush = timed(phases, 'telemetry_flush', app.telemetry.flush)
+
+    def request(event):
+        event = dict(event, ip_address='203.0.113.%d' % rng.randint(1, 254), user_agent='benchmark', http_method='GET')
+        start = time.perf_counter()
+        response = app.lambda_handler(event, None)
+        return (time.perf_counter() - start) * 1000, response
+
+    first_ms, response = request({'id': cold_id, 'lang': 'en'})
+    if not response.get('body', {}).get('Items'):
+        raise SystemExit("Cold request did not return the record: " + str(response)[:300])
+
+    scenarios = {}
+    scenarios['miss'] = [request({'id': i, 'lang': 'en'})[0] for i in miss_ids]
+    scenarios['hit'] = [request({'id': i, 'lang': 'en'})[0] for i in miss_ids]
+    scenarios['not_found'] = [request({'id': i, 'lang': 'en'})[0] for i in unknown_ids]
+    scenarios['batch'] = [
+        request({'ids': ','.join(batch_ids[i:i + args.batch_size]), 'lang': 'fr'})[0]
+        for i in range(0, len(batch_ids), args.batch_size)
+    ]
+
+    result = {
+        "rows": args.rows,
+        "cold": {
+            "import_ms": round(import_ms, 3),
+            "first_request_ms": round(first_ms, 3),
+            "total_ms": round(import_ms + first_ms, 3)
+        },
+        "scenarios": {name: percentiles(samples) for name, samples in scenarios.items()},
+        "phases": {name: dict(percentiles(samples), total_ms=round(sum(samples), 3)) for name, samples in phases.items()},
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "response_cache": app.cache.stats(),
+        "opensearch_calls": client.calls
+    }
+    with open(args.result, 'w') as f:
+        json.dump(result, f)
+
+def run_rows(args, rows):
+    parquet_path = write_parquet(rows, args.seed, args.data_dir)
+    with tempfile.NamedTemporaryFile(suffix='.json', delete=False) as f:
+        result_path = f.name
+    command = [
+        sys.executable, os.path.abspath(__file__), '--worker', '--rows', str(rows), '--parquet', parquet_path,
+        '--result', result_path, '--seed', str(args.seed), '--requests', str(args.requests),
+        '--batch-requests', str(args.batch_requests), '--batch-size', str(args.batch_size),
+        '--os-latency-ms', str(args.os_latency_ms), '--data-dir', args.data_dir
+    ]
+    for override in args.env:
+        command += ['--env', override]
+
+    #the handler prints on every request, keep its output out of the report
+    with open(os.devnull, 'w') as devnull:
+        subprocess.run(command, check=True, stdout=devnull if not args.verbose else None)
+    with open(result_path) as f:
+        result = json.load(f)
+    os.remove(result_path)
+    return result
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    except Exception:
+        return None
+
+def print_report(report, baseline=None):
+    previous = {r["rows"]: r for r in (baseline or {}).get("results", [])}
+    print("%9s %-10s %10s %10s %10s" % ("rows", "scenario", "p50 (ms)", "p95 (ms)", "p99 (ms)"))
+    for result in report["results"]:
+        rows = result["rows"]
+        print("%9d %-10s %10.1f %24s rss %.0f MB" % (rows, "cold", result["cold"]["total_ms"], "", result["peak_rss_mb"]))
+        for name, values in result["scenarios"].items():
+            line = "%9d %-10s %10.3f %10.3f %10.3f" % (rows, name, values["p50_ms"], values["p95_ms"], values["p99_ms"])
+            before = previous.get(rows, {}).get("scenarios", {}).get(name)
+            if before and before.get("p50_ms"):
+                line += "  p50 %+.0f%%" % ((values["p50_ms"] / before["p50_ms"] - 1) * 100)
+            print(line)
+        phases = ", ".join("%s %.1f" % (name, values["total_ms"]) for name, values in result["phases"].items())
+        print("%9s phases (total ms): %s" % ("", phases))
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--requests', type=int, default=500, help="requests per single-id scenario")
+    parser.add_argument('--batch-requests', type=int, default=50)
+    parser.add_argument('--batch-size', type=int, default=20)
+    parser.add_argument('--os-latency-ms', type=float, default=0.0, help="simulated OpenSearch round trip")
+    parser.add_argument('--env', action='append', default=[], help="handler environment override, KEY=VALUE")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--data-dir', default=os.path.join(tempfile.gettempdir(), 'geocore_benchmark'))
+    parser.add_argument('--output', default='id_v2_handler.json')
+    parser.add_argument('--compare', help="previous output to compare p50 latencies with")
+    parser.add_argument('--verbose', action='store_true', help="show the handler output")
+    parser.add_argument('--worker', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--parquet', help=argparse.SUPPRESS)
+    parser.add_argument('--result', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        args.rows = args.rows[0]
+        return run_worker(args)
+
+    import pandas as pd
+    import pyarrow as pa
+    report = {
+        "benchmark": "id_v2_handler",
+        "created": time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "pandas": pd.__version__,
+        "pyarrow": pa.__version__,
+        "machine": platform.platform(),
+        "config": {
+            "requests": args.requests, "batch_requests": args.batch_requests, "batch_size": args.batch_size,
+            "os_latency_ms": args.os_latency_ms, "env": args.env, "seed": args.seed
+        },
+        "results": [run_rows(args, rows) for rows in args.rows]
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+    print_report(report, baseline)
+    print("Results written to", args.output)
+
+if __name__ == '__main__':
+    main()
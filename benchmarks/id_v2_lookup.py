@@ -0,0 +1,63 @@
+"""
+Compare the cost of an id_v2 response-cache miss lookup as the catalogue grows.
+
+  - set_index: the previous path, astype(str) + set_index + .loc[[uuid]] on every miss
+  - id_index:  the id index built once with the snapshot, then lookup_rows (dict probe + .iloc)
+
+Usage: python benchmarks/id_v2_lookup.py [rows ...]
+"""
+import os
+import sys
+import time
+import uuid as uuid_lib
+import random
+import statistics
+import pandas as pd
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'id_v2'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from snapshot import build_id_index, lookup_rows
+
+DEFAULT_ROWS = [10000, 100000, 500000]
+LOOKUPS = 50
+
+def make_df(rows):
+    """Synthetic frame with the id column and a few payload columns"""
+    return pd.DataFrame({
+        'features_properties_id': [str(uuid_lib.uuid4()) for _ in range(rows)],
+        'features_properties_title_en': ['Title %d' % i for i in range(rows)],
+        'features_properties_title_fr': ['Titre %d' % i for i in range(rows)],
+        'features_geometry_coordinates': ['[[[-141.0, 41.0], [-52.0, 41.0], [-52.0, 83.0]]]'] * rows,
+    })
+
+def time_lookups(func, ids):
+    samples = []
+    for uuid in ids:
+        start = time.perf_counter()
+        func(uuid)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main(row_counts):
+    print("%10s %16s %16s %16s" % ("rows", "set_index (ms)", "id_index (ms)", "index build (ms)"))
+    for rows in row_counts:
+        df = make_df(rows)
+        ids = random.sample(df['features_properties_id'].tolist(), LOOKUPS)
+
+        def set_index_lookup(uuid):
+            geocore_df = df
+            geocore_df['features_properties_id'] = geocore_df['features_properties_id'].astype(str)
+            geocore_df = geocore_df.set_index('features_properties_id')
+            return geocore_df.loc[[uuid]]
+
+        start = time.perf_counter()
+        id_index = build_id_index(df)
+        build_ms = (time.perf_counter() - start) * 1000
+
+        old_ms = time_lookups(set_index_lookup, ids[:10])
+        new_ms = time_lookups(lambda uuid: lookup_rows(df, id_index, [uuid]), ids)
+        print("%10d %16.3f %16.3f %16.1f" % (rows, old_ms, new_ms, build_ms))
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
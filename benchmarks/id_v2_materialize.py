@@ -0,0 +1,63 @@
+"""
+Compare id_v2 MATERIALIZE_MODE settings: memory held by the item store and the
+latency of building one response item on a cache miss.
+
+  - off:  lookup_rows + build_items for the requested record on every miss
+  - dict: items built at load, a miss is a dict lookup
+  - json: items built at load and kept as JSON bytes, a miss is a lookup + json.loads
+
+Usage: python benchmarks/id_v2_materialize.py [rows ...]
+"""
+import os
+import sys
+import time
+import random
+import statistics
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'id_v2'))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from synthetic import make_geocore_df
+from snapshot import build_id_index, lookup_rows
+from records import build_items, materialize_items
+
+DEFAULT_ROWS = [10000, 50000]
+LOOKUPS = 200
+
+def median_ms(func, ids):
+    samples = []
+    for uuid in ids:
+        start = time.perf_counter()
+        func(uuid)
+        samples.append((time.perf_counter() - start) * 1000)
+    return statistics.median(samples)
+
+def main(row_counts):
+    print("%8s %6s %14s %14s %12s" % ("rows", "mode", "load (s)", "store (MB)", "miss (ms)"))
+    for rows in row_counts:
+        df = make_geocore_df(rows)
+        id_index = build_id_index(df)
+        ids = random.sample(df['features_properties_id'].tolist(), LOOKUPS)
+
+        off_ms = median_ms(lambda uuid: build_items(lookup_rows(df, id_index, [uuid])[1].iloc[0], uuid, ("en",))["en"], ids)
+        print("%8d %6s %14s %14s %12.3f" % (rows, "off", "-", "-", off_ms))
+
+        for mode in ("dict", "json"):
+            start = time.perf_counter()
+            store = materialize_items(df, mode)
+            load_s = time.perf_counter() - start
+            del store
+
+            #measured in a second build, tracing allocations slows the build down
+            tracemalloc.start()
+            store = materialize_items(df, mode)
+            store_mb = tracemalloc.get_traced_memory()[0] / 1e6
+            tracemalloc.stop()
+
+            miss_ms = median_ms(lambda uuid: store.get(uuid, "en"), ids)
+            print("%8d %6s %14.2f %14.1f %12.3f" % (rows, mode, load_s, store_mb, miss_ms))
+            del store
+
+if __name__ == '__main__':
+    main([int(arg) for arg in sys.argv[1:]] or DEFAULT_ROWS)
@@ -0,0 +1,105 @@
+"""
+Synthetic geocore records with the column schema of the parquet snapshot, for benchmarks.
+"""
+import json
+import random
+import uuid as uuid_lib
+import pandas as pd
+
+STATUSES = ['completed', 'onGoing', 'planned', 'historicalArchive']
+MAINTENANCE = ['asNeeded', 'annually', 'irregular', 'notPlanned', 'continual']
+TYPES = ['dataset', 'series', 'service']
+TOPICS = ['environment', 'imageryBaseMapsEarthCover', 'inlandWaters', 'transportation', 'boundaries']
+SOURCE_SYSTEMS = ['csw-fgp', 'eodms', 'sentinel1', 'rcm-ard', 'csw-nrcan']
+LANGUAGES = ['eng; CAN', 'fra; CAN']
+
+def make_contact(i):
+    return json.dumps([{
+        "individual": "Contact %d" % i,
+        "organisation": {
+            "en": "Government of Canada; Natural Resources Canada; Branch %d" % (i % 40),
+            "fr": "Gouvernement du Canada; Ressources naturelles Canada; Direction %d" % (i % 40)
+        },
+        "role": "pointOfContact",
+        "email": {"en": "contact%d@example.gc.ca" % i, "fr": "contact%d@example.gc.ca" % i},
+        "address": {"en": "580 Booth Street", "fr": "580 rue Booth"}
+    }])
+
+def make_options(i):
+    return json.dumps([{
+        "url": "https://example.gc.ca/data/%d.zip" % i,
+        "protocol": "HTTPS",
+        "name": {"en": "Download %d" % i, "fr": "Téléchargement %d" % i},
+        "description": {"en": "Dataset;ZIP;eng", "fr": "Données;ZIP;fra"}
+    } for _ in range(3)])
+
+def make_coordinates(rng):
+    west, south = rng.uniform(-141, -60), rng.uniform(42, 75)
+    return json.dumps([[[west, south], [west + 1, south], [west + 1, south + 1], [west, south + 1], [west, south]]])
+
+def make_geocore_df(rows, seed=0, parent_ratio=0.05):
+    """
+    Build a dataframe shaped like the geocore parquet snapshot
+    :param rows: number of records
+    :param seed: random seed so runs are reproducible
+    :param parent_ratio: share of records that are collections with children
+    :return dataframe: synthetic geocore records
+    """
+    rng = random.Random(seed)
+    ids = [str(uuid_lib.UUID(int=rng.getrandbits(128), version=4)) for _ in range(rows)]
+    parents = ids[:max(int(rows * parent_ratio), 1)]
+    parent_ids = [rng.choice(parents) if i >= len(parents) and rng.random() < 0.5 else None for i in range(rows)]
+    dates = pd.date_range('2015-01-01', periods=3650, freq='D').strftime('%Y-%m-%d').tolist()
+
+    return pd.DataFrame({
+        'features_properties_id': ids,
+        'features_properties_parentIdentifier': parent_ids,
+        'features_geometry_coordinates': [make_coordinates(rng) for _ in range(rows)],
+        'features_properties_title_en': ['Synthetic record %d about %s' % (i, rng.choice(TOPICS)) for i in range(rows)],
+        'features_properties_title_fr': ['Enregistrement synthétique %d sur %s' % (i, rng.choice(TOPICS)) for i in range(rows)],
+        'features_properties_description_en': ['Description of record %d. ' % i * 8 for i in range(rows)],
+        'features_properties_description_fr': ['Description de l\'enregistrement %d. ' % i * 8 for i in range(rows)],
+        'features_properties_keywords_en': ['keyword %d, canada, geospatial' % (i % 500) for i in range(rows)],
+        'features_properties_keywords_fr': ['mot-clé %d, canada, géospatial' % (i % 500) for i in range(rows)],
+        'features_properties_useLimits_en': ['Open Government Licence - Canada'] * rows,
+        'features_properties_useLimits_fr': ['Licence du gouvernement ouvert - Canada'] * rows,
+        'features_properties_date_published_date': [rng.choice(dates) for _ in range(rows)],
+        'features_properties_date_created_date': [rng.choice(dates) for _ in range(rows)],
+        'features_properties_date_modified': [rng.choice(dates) + 'T12:00:00' for _ in range(rows)],
+        'features_properties_dateStamp': [rng.choice(dates) for _ in range(rows)],
+        'features_properties_temporalExtent_begin': [rng.choice(dates) for _ in range(rows)],
+        'features_properties_temporalExtent_end': [rng.choice(dates + [None]) for _ in range(rows)],
+        'features_properties_options': [make_options(i) for i in range(rows)],
+        'features_properties_contact': [make_contact(i) for i in range(rows)],
+        'features_properties_distributor': [make_contact(i) for i in range(rows)],
+        'features_properties_credits': [json.dumps([{"name": "Credit %d" % i}]) for i in range(rows)],
+        'features_properties_cited': [make_contact(i) for i in range(rows)],
+        'features_properties_graphicOverview': [json.dumps([{"overviewFileName": "https://example.gc.ca/%d.png" % i}]) for i in range(rows)],
+        'features_properties_topicCategory': [rng.choice(TOPICS) for _ in range(rows)],
+        'features_properties_spatialRepresentation': [rng.choice(['vector', 'grid']) for _ in range(rows)],
+        'features_properties_type': [rng.choice(TYPES) for _ in range(rows)],
+        'features_properties_refSys': ['EPSG:3978'] * rows,
+        'features_properties_refSys_version': ['8.9.2'] * rows,
+        'features_properties_status': [rng.choice(STATUSES) for _ in range(rows)],
+        'features_properties_maintenance': [rng.choice(MAINTENANCE) for _ in range(rows)],
+        'features_properties_metadataStandard_en': ['North American Profile of ISO 19115:2003'] * rows,
+        'features_properties_metadataStandardVersion': ['2003'] * rows,
+        'features_properties_distributionFormat_name': ['ESRI Shapefile'] * rows,
+        'features_properties_distributionFormat_format': ['SHP'] * rows,
+        'features_properties_accessConstraints': ['otherRestrictions'] * rows,
+        'features_properties_otherConstraints_en': [None] * rows,
+        'features_properties_dataSetURI': ['https://example.gc.ca/dataset/%s' % i for i in ids],
+        'features_properties_locale_language': ['en'] * rows,
+        'features_properties_locale_country': ['CAN'] * rows,
+        'features_properties_locale_encoding': ['utf8'] * rows,
+        'features_properties_language': [rng.choice(LANGUAGES) for _ in range(rows)],
+        'features_properties_characterSet': ['utf8'] * rows,
+        'features_properties_environmentDescription': ['ESRI ArcGIS'] * rows,
+        'features_properties_supplementalInformation_en': [None] * rows,
+        'features_properties_plugins': [None] * rows,
+        'features_properties_sourceSystemName': [rng.choice(SOURCE_SYSTEMS) for _ in range(rows)],
+        'features_properties_eoCollection': [None] * rows,
+        'features_properties_eoFilters': [json.dumps([{"name": "beamMode", "values": ["IW", "EW"]}]) for _ in range(rows)],
+        'features_similarity': [json.dumps([{"sim": rng.choice(ids), "score": rng.random()} for _ in range(10)]) for _ in range(rows)],
+        'features_popularity': [int(rng.paretovariate(1.2)) for _ in range(rows)]
+    })
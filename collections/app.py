@@ -9,12 +9,34 @@ import awswrangler as wr
 
 from uuid import UUID
 from botocore.exceptions import ClientError
+from geocore_common.refresh import SnapshotRefresher
+from geocore_common.snapshot import load_geocore_snapshot, read_geocore_parquet
+from geocore_common.metrics import Metrics
+from geocore_common.params import parse_ids
+from hierarchy import Hierarchy, HIERARCHY_COLUMNS
 
 PARQUET_BUCKET_NAME = os.environ['PARQUET_BUCKET_NAME']
 MAX_CHILD_OR_SIBLING_LENGTH = int(os.environ['MAX_CHILD_OR_SIBLING_LENGTH'])
 
-cache_df = pd.DataFrame()
+#Seconds between checks of the parquet objects for a new snapshot, 0 keeps the first snapshot forever
+SNAPSHOT_CHECK_SECONDS = int(os.environ.get('SNAPSHOT_CHECK_SECONDS', 300))
 
+#Convert text columns to categoricals and Arrow-backed strings at load
+OPTIMIZE_DTYPES = os.environ.get('OPTIMIZE_DTYPES', 'true').lower() == 'true'
+
+#Keep the decoded snapshot in /tmp as an Arrow file tagged with the parquet ETags, mapped on the next cold start
+LOCAL_SNAPSHOT_CACHE = os.environ.get('LOCAL_SNAPSHOT_CACHE', 'true').lower() == 'true'
+
+#Traversal mode (?depth=N): deepest descendant level returned and most records returned on one level
+MAX_TRAVERSAL_DEPTH = int(os.environ.get('MAX_TRAVERSAL_DEPTH', 10))
+MAX_TRAVERSAL_LEVEL_LENGTH = int(os.environ.get('MAX_TRAVERSAL_LEVEL_LENGTH', 500))
+
+#Maximum number of ids accepted by one batch request (?ids=X,Y,Z)
+MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', 100))
+
+metrics = Metrics('collections')
+
+@metrics.handler
 def lambda_handler(event, context):
     
     """ 
@@ -31,56 +53,51 @@ def lambda_handler(event, context):
         lang = event["lang"]
     except:
         lang = "en"
+
+    #optional traversal mode, returns the ancestor chain and the descendants down to this depth
+    depth = parse_depth(event.get("depth"))
+
+    #page of the child or sibling list, next_offset in the response fetches the following one
+    offset = parse_int(event.get("offset"), 0, 0, None)
+    limit = parse_int(event.get("limit"), MAX_CHILD_OR_SIBLING_LENGTH, 1, MAX_CHILD_OR_SIBLING_LENGTH)
+
+    #optional batch mode, self, parent and counts of several records
+    ids = event.get("ids", False)
+    if ids:
+        children = str(event.get("children", "false")).lower() == "true"
+        return batch_lambda_handler(parse_ids(ids), lang, limit if children else 0)
     
 
     if uuid != False:
         
-        geocore_df = get_df_cache()
-        if geocore_df.empty:
-            try:
-                #print("Finding the parent and other children for uuid: ", uuid)
-                geocore_df = wr.s3.read_parquet(path=PARQUET_BUCKET_NAME)
-                #print("From S3")
-                add_df_to_cache(geocore_df)
-            except ClientError as e:
-                message += "Error accessing " + PARQUET_BUCKET_NAME
-                return {
-                    'statusCode': 200,
-                    'body': json.dumps(message)
-                }
-        else:
-            print("From DF Cache")
+        try:
+            #Read the parquet file and build its hierarchy index on cold start, later invocations use the cached snapshot
+            hierarchy = get_snapshot()
+        except ClientError as e:
+            message += "Error accessing " + PARQUET_BUCKET_NAME
+            return {
+                'statusCode': 200,
+                'body': json.dumps(message)
+            }
         
         #self
-        self_json = find_self(geocore_df, uuid)
+        self_json = find_self(hierarchy, uuid)
         
         #parent
-        parent_json, parent_id  = find_parent(geocore_df, uuid)
+        parent_json, parent_id  = find_parent(hierarchy, uuid)
         
-        #child
+        #child, already sorted by title in lang
         child_json = None
         child_count = 0
-        child_json, child_count = find_children(geocore_df, uuid)
-        
-        if child_json != None:
-            if lang == 'en':
-                child_json = sorted(child_json, key=lambda x: x['description_en'], reverse=True)
-            elif lang == 'fr':
-                child_json = sorted(child_json, key=lambda x: x['description_fr'], reverse=True)
-            else:
-                child_json = sorted(child_json, key=lambda x: x['description_fr'], reverse=True)
-
-        #sibling
+        child_json, child_count = find_children(hierarchy, uuid, lang, offset, limit)
+        page_count = child_count
+
+        #sibling, only listed for a record without children
         sibling_json = None
         sibling_count = 0
-        if parent_json != None and child_json == None:
-            sibling_json, sibling_count  = find_siblings(geocore_df, parent_id, uuid)
-            if lang == 'en':
-                sibling_json = sorted(sibling_json, key=lambda x: x['description_en'], reverse=True)
-            elif lang == 'fr':
-                sibling_json = sorted(sibling_json, key=lambda x: x['description_fr'], reverse=True)
-            else:
-                sibling_json = sorted(sibling_json, key=lambda x: x['description_fr'], reverse=True)
+        if parent_json != None and child_count == 0:
+            sibling_json, sibling_count  = find_siblings(hierarchy, parent_id, uuid, lang, offset, limit)
+            page_count = sibling_count
         
     else:
         message += "No id parameter was passed. Usage: ?id=XYZ"
@@ -89,156 +106,164 @@ def lambda_handler(event, context):
             'body': message
         }
     
-    return {
+    response = {
         'statusCode': 200,
         'sibling_count': sibling_count,
         'child_count': child_count,
         'self': self_json,
         'parent': parent_json,
         'sibling': sibling_json,
-        'child': child_json
+        'child': child_json,
+        'offset': offset,
+        'limit': limit,
+        'next_offset': offset + limit if offset + limit < page_count else None
     }
 
-def find_self(geocore_df, uuid):
+    if depth is not None:
+        with metrics.span('traversal'):
+            response['ancestors'] = hierarchy.ancestors(uuid)
+            response['descendants'] = hierarchy.descendants(uuid, depth, MAX_CHILD_OR_SIBLING_LENGTH, MAX_TRAVERSAL_LEVEL_LENGTH, lang)
+            response['depth'] = depth
+
+    return response
+
+def batch_lambda_handler(ids, lang, child_limit):
     """
-    Find uuid if it exists
-    :param geocore_df: dataframe containing all geocore records
-    :param uuid: unique id we are looking up 
-    :return message: JSON of the uuid and record title in english and french
+    Return self, parent and child/sibling counts of several ids in one response, with the
+    first page of children when child_limit is not 0
     """
-    
-    self_desc_en = ""
-    self_desc_fr = ""
-    self_df = geocore_df[geocore_df['features_properties_id'] == uuid]
+    if len(ids) > MAX_BATCH_IDS:
+        return {
+            'statusCode': 200,
+            'body': "A maximum of " + str(MAX_BATCH_IDS) + " ids can be requested at once"
+        }
 
-    if len(self_df) == 0:
-        self_message = None
-    else:
-        try:
-            self_desc_en = self_df.iloc[0]['features_properties_title_en'].replace('"', '\\"')
-            self_desc_fr = self_df.iloc[0]['features_properties_title_fr'].replace('"', '\\"')
-            self_message = '{ "id": "' + uuid + '", "description_en": "' + self_desc_en + '", "description_fr": "' + self_desc_fr + '"}'
-        except:
-            self_message = None
+    try:
+        hierarchy = get_snapshot()
+    except ClientError as e:
+        return {
+            'statusCode': 200,
+            'body': json.dumps("Error accessing " + PARQUET_BUCKET_NAME)
+        }
+
+    metrics.gauge('batch_ids', len(ids), 'Count')
+    with metrics.span('lookup'):
+        summaries = hierarchy.summaries(ids, lang, child_limit)
+
+    return {
+        'statusCode': 200,
+        'items': [summaries[uuid] for uuid in ids if uuid in summaries],
+        'not_found': [uuid for uuid in ids if uuid not in summaries]
+    }
 
-    return nonesafe_loads(self_message)
+def parse_depth(depth):
+    """
+    Parse the depth of a traversal request
+    :return depth: int between 0 and MAX_TRAVERSAL_DEPTH, None when no traversal was requested
+    """
+    if depth is None or depth == "":
+        return None
+    try:
+        depth = int(depth)
+    except (TypeError, ValueError):
+        return None
+    return max(0, min(depth, MAX_TRAVERSAL_DEPTH))
+
+def parse_int(value, default, minimum, maximum):
+    """
+    Parse an integer query string parameter
+    :return value: int clamped between minimum and maximum (None for no bound), default when missing or invalid
+    """
+    if value is None or value == "":
+        return default
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return default
+    value = max(minimum, value)
+    return value if maximum is None else min(value, maximum)
+
+@metrics.timed('lookup')
+def find_self(hierarchy, uuid):
+    """
+    Find uuid if it exists
+    :param hierarchy: Hierarchy index of the geocore records
+    :param uuid: unique id we are looking up 
+    :return self_json: uuid and record title in english and french
+    """
+    position = hierarchy.position(uuid)
+    if position is None:
+        return None
+    return hierarchy.describe([position])[0]
     
-def find_parent(geocore_df, uuid):
+@metrics.timed('lookup')
+def find_parent(hierarchy, uuid):
     """
     Find parent record of a uuid if it exists
-    :param geocore_df: dataframe containing all geocore records
+    :param hierarchy: Hierarchy index of the geocore records
     :param uuid: unique id we are looking up 
-    :return message: JSON of the uuid and record title in english and french
+    :return parent_json: uuid and record title in english and french of the parent
     :return parent_id: uuid of the parent record
     """
-    parent_id = ""
-    parent_desc_en = ""
-    parent_desc_fr = ""
-    parent_df = geocore_df[geocore_df['features_properties_id'] == uuid]
+    position = hierarchy.position(uuid)
+    if position is None:
+        return None, ""
 
-    if len(parent_df) == 0:
-        parent_message = None
-    else:
-        try:
-            parent_id = parent_df.iloc[0]['features_properties_parentIdentifier']
-            parent_row = geocore_df.loc[geocore_df['features_properties_id'] == parent_id]
-            parent_desc_en = parent_row['features_properties_title_en'].values[0].replace('"', '\\"')
-            parent_desc_fr = parent_row['features_properties_title_fr'].values[0].replace('"', '\\"')
-            parent_message = '{ "id": "' + parent_id + '", "description_en": "' + parent_desc_en + '", "description_fr": "' + parent_desc_fr + '"}'
-        except:
-            parent_message = None
-            parent_id = uuid
-
-    return nonesafe_loads(parent_message), parent_id
-
-def find_siblings(geocore_df, parent_id, uuid):
+    parent_id = hierarchy.parents[position]
+    parent_position = hierarchy.id_index.get(parent_id) if isinstance(parent_id, str) else None
+    if parent_position is None:
+        return None, uuid
+    return hierarchy.describe([parent_position])[0], parent_id
+
+@metrics.timed('lookup')
+def find_siblings(hierarchy, parent_id, uuid, lang='en', offset=0, limit=MAX_CHILD_OR_SIBLING_LENGTH):
     """
     Find sibling records of a uuid if it exists
-    :param geocore_df: dataframe containing all geocore records
+    :param hierarchy: Hierarchy index of the geocore records
     :param uuid: unique id we are looking up
-    :return message: JSON of the uuid and record title in english and french
-    :return parent_id: uuid of the parent record
+    :param lang: language of the titles the siblings are sorted by, descending
+    :param offset: number of siblings skipped
+    :param limit: most siblings returned
+    :return sibling_json: list of the sibling uuids and record titles in english and french, None if there are none
+    :return sibling_count: count of sibling records
     """
-    child_array_id = []
-    child_array_desc_en = []
-    child_array_desc_fr = []
-    other_children_df = geocore_df[geocore_df['features_properties_parentIdentifier'] == parent_id]
-    
-    #cannot be its own sibling. remove self from the siblings dataframe
-    other_children_df = other_children_df[other_children_df['features_properties_id'] != uuid]
+    #cannot be its own sibling. remove self from the siblings
+    sibling_positions, sibling_count = hierarchy.child_page(parent_id, lang, offset, limit, exclude=uuid)
+    return hierarchy.describe(sibling_positions) or None, sibling_count
     
-    if len(other_children_df) == 0:
-        child_message = None
-    else:
-        child_message = "["
-
-        #vectorized optimized code 
-        child_array_id.extend(other_children_df['features_properties_id'].tolist())
-        child_array_desc_en.extend(other_children_df['features_properties_title_en'].tolist())
-        child_array_desc_fr.extend(other_children_df['features_properties_title_fr'].tolist())
-            
-        if (len(other_children_df) > MAX_CHILD_OR_SIBLING_LENGTH):
-            child_length = MAX_CHILD_OR_SIBLING_LENGTH
-        else:
-            child_length = len(other_children_df)
-            
-        for i in range(0,child_length):
-            child_message += '{ "id": "' + child_array_id[i] + '", "description_en": "' + child_array_desc_en[i].replace('"', '\\"') + '", "description_fr": "' + child_array_desc_fr[i].replace('"', '\\"')  + '"}'
-            if i != child_length-1:
-                child_message += ', '
-        child_message += "]"
-    
-    return nonesafe_loads(child_message), len(other_children_df)
-    
-def find_children(geocore_df, uuid):
+@metrics.timed('lookup')
+def find_children(hierarchy, uuid, lang='en', offset=0, limit=MAX_CHILD_OR_SIBLING_LENGTH):
     """
     Find child records if it exists
-    :param geocore_df: dataframe containing all geocore records
+    :param hierarchy: Hierarchy index of the geocore records
     :param uuid: unique id we are looking up
-    :return child_json: JSON of the child uuid and record title in english and french
+    :param lang: language of the titles the children are sorted by, descending
+    :param offset: number of children skipped
+    :param limit: most children returned
+    :return child_json: list of the child uuids and record titles in english and french, None if there are none
     :return child_count: count of child records
     """
-    child_array_id = []
-    child_array_desc_en = []
-    child_array_desc_fr = []
-    other_children_df = geocore_df[geocore_df['features_properties_parentIdentifier'] == uuid]
-    
-    #cannot be its own sibling. remove self from the siblings dataframe
-    other_children_df = other_children_df[other_children_df['features_properties_id'] != uuid]
-    
-    if len(other_children_df) == 0:
-        child_message = None
-    else:
-        child_message = "["
-        
-        #vectorized optimized code 
-        child_array_id.extend(other_children_df['features_properties_id'].tolist())
-        child_array_desc_en.extend(other_children_df['features_properties_title_en'].tolist())
-        child_array_desc_fr.extend(other_children_df['features_properties_title_fr'].tolist())
-        
-        if (len(other_children_df) > MAX_CHILD_OR_SIBLING_LENGTH):
-            child_length = MAX_CHILD_OR_SIBLING_LENGTH
-        else:
-            child_length = len(other_children_df)
-            
-        for i in range(0,child_length):
-            child_message += '{ "id": "' + child_array_id[i].replace('"', '\\"') + '", "description_en": "' + child_array_desc_en[i].replace('"', '\\"')  + '", "description_fr": "' + child_array_desc_fr[i].replace('"', '\\"') + '"}'
-            if i != child_length-1:
-                child_message += ', '
-        child_message += "]"
-    
-    return nonesafe_loads(child_message), len(other_children_df)
-    
-def nonesafe_loads(obj):
-    if obj is not None:
-        return json.loads(obj)
-
-# Add dataframe to cache
-def add_df_to_cache(dataframe):
-    global cache_df
-    cache_df = dataframe.copy()
-
-# Get dataframe to cache
-def get_df_cache():
-    global cache_df
-    return cache_df
\ No newline at end of file
+    #cannot be its own child. remove self from the children
+    child_positions, child_count = hierarchy.child_page(uuid, lang, offset, limit, exclude=uuid)
+    return hierarchy.describe(child_positions) or None, child_count
+
+# Read the parquet snapshot and build its hierarchy index, called on cold start and by the refresher
+@metrics.timed('snapshot_load')
+def load_snapshot(signature=None):
+    return load_geocore_snapshot('collections-hierarchy', signature, read_snapshot, build_hierarchy, LOCAL_SNAPSHOT_CACHE, metrics)
+
+# Read the columns of the hierarchy from the parquet snapshot on S3 and compact their dtypes
+def read_snapshot():
+    #parentIdentifier is categorical, comparing it with an id never yields <NA> for missing parents
+    return read_geocore_parquet(PARQUET_BUCKET_NAME, HIERARCHY_COLUMNS, OPTIMIZE_DTYPES, metrics=metrics)
+
+# Build the hierarchy index of a dataframe
+def build_hierarchy(geocore_df):
+    with metrics.span('index_build'):
+        return Hierarchy(geocore_df)
+
+refresher = SnapshotRefresher(PARQUET_BUCKET_NAME, load_snapshot, SNAPSHOT_CHECK_SECONDS, metrics=metrics)
+
+# Get the current snapshot, reloaded in the background when the parquet changes
+def get_snapshot():
+    return refresher.get()
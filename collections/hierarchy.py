@@ -0,0 +1,236 @@
+import numpy as np
+import pandas as pd
+
+from geocore_common.snapshot import GeocoreSnapshot, ID_COLUMN, PARENT_COLUMN
+
+TITLE_EN_COLUMN = 'features_properties_title_en'
+TITLE_FR_COLUMN = 'features_properties_title_fr'
+
+#the only parquet columns read by collections
+HIERARCHY_COLUMNS = [ID_COLUMN, PARENT_COLUMN, TITLE_EN_COLUMN, TITLE_FR_COLUMN]
+
+#longest ancestor chain followed, deeper chains are cut
+MAX_ANCESTORS = 100
+
+class Hierarchy(GeocoreSnapshot):
+    """
+    Parent/child index of a collections snapshot, built once when the snapshot is loaded.
+    id_index (from GeocoreSnapshot) maps each id to its first row position, so a request
+    no longer scans the id and parentIdentifier columns.
+
+    Children are kept sorted by title descending, once per language: order[lang] holds
+    the row positions of all children grouped by parent, ranges[lang] maps a parent id
+    to its (start, end) slice of order and rank[lang] maps a row position to its index
+    in order. A page of children is a slice, whatever the number of children.
+    """
+    def __init__(self, dataframe):
+        super().__init__(dataframe)
+        self.ids = dataframe[ID_COLUMN].tolist() if ID_COLUMN in dataframe.columns else []
+        self.parents = dataframe[PARENT_COLUMN].tolist() if PARENT_COLUMN in dataframe.columns else [None] * len(self.ids)
+
+        #ids present more than once, excluding them from a child list needs a scan of the list
+        counts = {}
+        for uuid in self.ids:
+            counts[uuid] = counts.get(uuid, 0) + 1
+        self.duplicated_ids = {uuid for uuid, count in counts.items() if count > 1}
+
+        self.order = {}
+        self.ranges = {}
+        self.rank = {}
+        for lang, column in (('en', TITLE_EN_COLUMN), ('fr', TITLE_FR_COLUMN)):
+            self.order[lang], self.ranges[lang], self.rank[lang] = self._sort_children(dataframe, column)
+
+    def _sort_children(self, dataframe, title_column):
+        """
+        Row positions of all children grouped by parent and sorted by title descending,
+        ties in dataframe order like sorted(..., reverse=True) on the rows of one parent
+        """
+        codes, parent_ids = pd.factorize(pd.Series(self.parents, dtype=object))
+        titles = dataframe[title_column].reset_index(drop=True) if title_column in dataframe.columns else None
+        frame = pd.DataFrame({'parent': codes, 'title': titles if titles is not None else ''})
+        frame = frame[frame['parent'] >= 0].sort_values(['parent', 'title'], ascending=[True, False], kind='stable')
+
+        order = frame.index.to_numpy(dtype=np.int64)
+        groups = frame['parent'].to_numpy()
+        starts = np.flatnonzero(np.diff(groups)) + 1
+        ranges = {}
+        for start, end in zip(np.concatenate(([0], starts)), np.concatenate((starts, [len(order)]))):
+            if end > start and isinstance(parent_ids[groups[start]], str):
+                ranges[parent_ids[groups[start]]] = (int(start), int(end))
+
+        rank = np.full(len(self.ids), -1, dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        return order, ranges, rank
+
+    def position(self, uuid):
+        """
+        Row position of a record, None if the id is unknown
+        """
+        return self.id_index.get(uuid)
+
+    def child_page(self, parent_id, lang='en', offset=0, limit=None, exclude=None):
+        """
+        One page of the records whose parent is parent_id, sorted by title descending
+        :param lang: 'en' sorts by the english title, anything else by the french one
+        :param offset: number of children skipped
+        :param limit: most children returned, None returns all of them
+        :param exclude: id left out of the result, e.g. the record whose siblings are listed
+        :return positions: row positions of the page
+        :return total: number of children, excluded id not counted
+        """
+        lang = 'en' if lang == 'en' else 'fr'
+        order = self.order[lang]
+        start, end = self.ranges[lang].get(parent_id, (0, 0))
+
+        #indexes in order of the excluded id, at most one unless the id is duplicated
+        skipped = []
+        if exclude is not None and end > start:
+            if exclude in self.duplicated_ids:
+                skipped = [index for index in range(start, end) if self.ids[order[index]] == exclude]
+            else:
+                position = self.id_index.get(exclude)
+                if position is not None and self.parents[position] == parent_id:
+                    skipped = [int(self.rank[lang][position])]
+        total = end - start - len(skipped)
+
+        first = start + max(0, offset)
+        for index in skipped:
+            if index <= first:
+                first += 1
+        if limit is None:
+            limit = total
+        last = min(end, first + max(0, limit) + len(skipped))
+        positions = [int(order[index]) for index in range(first, last) if index not in skipped]
+        return positions[:max(0, limit)], total
+
+    def values(self, column, positions):
+        """
+        Values of a column at the given row positions, as a list
+        """
+        #take on the backing array skips building an indexed Series for a handful of rows
+        return self.df[column].array.take(np.asarray(positions, dtype=np.intp)).tolist()
+
+    def describe(self, positions):
+        """
+        id and titles of the records at the given positions, in the shape returned by find_self
+        """
+        ids = [self.ids[position] for position in positions]
+        titles_en = self.values(TITLE_EN_COLUMN, positions)
+        titles_fr = self.values(TITLE_FR_COLUMN, positions)
+        return [
+            {"id": uuid, "description_en": _text(title_en), "description_fr": _text(title_fr)}
+            for uuid, title_en, title_fr in zip(ids, titles_en, titles_fr)
+        ]
+
+    def summaries(self, uuids, lang='en', child_limit=0):
+        """
+        Self, parent and child/sibling counts of several records in one pass, the titles
+        of all of them read with one take per column
+        :param uuids: unique ids we are looking up
+        :param lang: language of the titles the children are sorted by
+        :param child_limit: size of the first page of children returned in child, 0 for none
+        :return summaries: dict of id -> summary, unknown ids are left out. Counts follow the
+                           single id response: siblings are only counted for a record with a
+                           known parent and no children.
+        """
+        found = [(uuid, self.id_index[uuid]) for uuid in uuids if uuid in self.id_index]
+
+        pages = []
+        wanted = []
+        for uuid, position in found:
+            parent_id = self.parents[position]
+            parent_position = self.id_index.get(parent_id) if isinstance(parent_id, str) else None
+            child_positions, child_count = self.child_page(uuid, lang, 0, child_limit, exclude=uuid)
+            sibling_count = 0
+            if parent_position is not None and child_count == 0:
+                sibling_count = self.child_page(parent_id, lang, 0, 0, exclude=uuid)[1]
+            pages.append((uuid, parent_position, child_positions, child_count, sibling_count))
+            wanted.append(position)
+            if parent_position is not None:
+                wanted.append(parent_position)
+            wanted.extend(child_positions)
+
+        records = iter(self.describe(wanted))
+        summaries = {}
+        for uuid, parent_position, child_positions, child_count, sibling_count in pages:
+            summary = {"id": uuid, "self": next(records)}
+            summary["parent"] = next(records) if parent_position is not None else None
+            summary["child_count"] = child_count
+            summary["sibling_count"] = sibling_count
+            if child_limit:
+                summary["child"] = [next(records) for child_position in child_positions] or None
+            summaries[uuid] = summary
+        return summaries
+
+    def ancestors(self, uuid, max_depth=MAX_ANCESTORS):
+        """
+        Parent, grandparent, ... of a record, nearest first
+        :param uuid: unique id we are looking up
+        :param max_depth: longest chain returned
+        :return ancestors: list of records as returned by describe, stops at a missing parent or a cycle
+        """
+        position = self.position(uuid)
+        if position is None:
+            return []
+
+        chain = []
+        seen = {position}
+        parent_id = self.parents[position]
+        while isinstance(parent_id, str) and len(chain) < max_depth:
+            parent_position = self.id_index.get(parent_id)
+            if parent_position is None or parent_position in seen:
+                break
+            seen.add(parent_position)
+            chain.append(parent_position)
+            parent_id = self.parents[parent_position]
+        return self.describe(chain)
+
+    def descendants(self, uuid, depth, max_children, max_per_level, lang='en'):
+        """
+        Tree of the descendants of a record, walked one level at a time
+        :param uuid: unique id we are looking up
+        :param depth: number of levels below the record, 1 returns its children
+        :param max_children: most children returned under one record
+        :param max_per_level: most records returned on one level
+        :param lang: language of the titles the children are sorted by
+        :return descendants: list of records as returned by describe, each with the total number of
+                             its children in child_count and, above the last level, the returned
+                             ones in children. A record reached twice (cycle) is only returned once.
+        """
+        position = self.position(uuid)
+        if position is None or depth < 1:
+            return []
+
+        seen = {position}
+        root = {"id": uuid}
+        frontier = [root]
+        for level in range(depth):
+            level_count = 0
+            next_frontier = []
+            for node in frontier:
+                positions, node["child_count"] = self.child_page(node["id"], lang, 0, max_children, exclude=node["id"])
+                kept = []
+                for child_position in positions:
+                    if len(kept) >= max_children or level_count >= max_per_level:
+                        break
+                    if child_position in seen:
+                        continue
+                    seen.add(child_position)
+                    kept.append(child_position)
+                    level_count += 1
+                node["children"] = self.describe(kept)
+                next_frontier.extend(node["children"])
+            frontier = next_frontier
+            if not frontier:
+                break
+
+        #records on the last level only say whether they can be expanded
+        for node in frontier:
+            node["child_count"] = self.child_page(node["id"], lang, 0, 0, exclude=node["id"])[1]
+        return root["children"]
+
+    def __len__(self):
+        return len(self.ids)
+
+def _text(value):
+    return value if isinstance(value, str) else None
@@ -0,0 +1,4 @@
+"""
+Code shared by the geocore lambdas. The package is copied into each lambda
+folder at build time, see the README.
+"""
@@ -0,0 +1,62 @@
+import pandas as pd
+
+#Arrow-backed strings hold the text in one buffer instead of one Python object per value
+STRING_DTYPE = pd.StringDtype("pyarrow")
+
+#low-cardinality geocore columns that are always made categorical
+CATEGORICAL_COLUMNS = [
+    'features_properties_status',
+    'features_properties_maintenance',
+    'features_properties_type',
+    'features_properties_topicCategory',
+    'features_properties_sourceSystemName',
+    'features_properties_language',
+    'features_properties_spatialRepresentation',
+    'features_properties_characterSet',
+    'features_properties_parentIdentifier'
+]
+
+def optimize_dtypes(dataframe, categorical_columns=CATEGORICAL_COLUMNS, date_columns=(), max_category_ratio=0.5, report=True):
+    """
+    Convert the text columns of a snapshot to compact dtypes, in place
+    :param dataframe: dataframe read from the parquet snapshot
+    :param categorical_columns: text columns always converted to categoricals
+    :param date_columns: columns parsed once to datetime64 (unparseable values become NaT)
+    :param max_category_ratio: other text columns with at most this ratio of distinct values
+                               to rows become categoricals, the rest Arrow-backed strings
+    :param report: print the memory used by each column before and after
+    :return dataframe: the same dataframe
+    """
+    before = dataframe.memory_usage(deep=True, index=False) if report else None
+
+    for column in dataframe.columns:
+        series = dataframe[column]
+        if column in date_columns:
+            dataframe[column] = pd.to_datetime(series, errors='coerce')
+        elif not _is_text(series):
+            continue
+        elif column in categorical_columns or series.nunique(dropna=True) <= max_category_ratio * len(series):
+            dataframe[column] = series.astype('category')
+        elif not isinstance(series.dtype, pd.StringDtype):
+            dataframe[column] = series.astype(STRING_DTYPE)
+
+    if report:
+        print_memory_report(before, dataframe.memory_usage(deep=True, index=False), dataframe.dtypes)
+    return dataframe
+
+def print_memory_report(before, after, dtypes, top=15):
+    """
+    Print the memory of the largest columns and the total, before and after optimize_dtypes
+    """
+    print("Snapshot memory by column (MB, before -> after, dtype):")
+    for column in before.sort_values(ascending=False).index[:top]:
+        print(f"  {column}: {before[column] / 1e6:.1f} -> {after[column] / 1e6:.1f} {dtypes[column]}")
+    total_before = before.sum()
+    total_after = after.sum()
+    ratio = total_before / total_after if total_after else 0
+    print(f"Snapshot memory: {total_before / 1e6:.1f} MB -> {total_after / 1e6:.1f} MB ({ratio:.1f}x)")
+
+def _is_text(series):
+    if isinstance(series.dtype, pd.StringDtype):
+        return True
+    return series.dtype == object and pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty')
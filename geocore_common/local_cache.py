@@ -0,0 +1,97 @@
+import os
+import json
+import shutil
+import hashlib
+import pyarrow as pa
+
+#Directory of the decoded snapshots kept between cold starts of the same container
+LOCAL_SNAPSHOT_DIR = os.environ.get('LOCAL_SNAPSHOT_DIR', '/tmp/geocore_snapshots')
+
+def cached_dataframe(name, signature, loader, directory=LOCAL_SNAPSHOT_DIR):
+    """
+    Return the dataframe saved under name if it was written for the same source signature,
+    otherwise call loader and save its result for the next cold start
+    :param name: name of the local copy, e.g. the lambda or the S3 key it was read from
+    :param signature: ETag(s) of the source objects, None skips the local copy
+    :param loader: function returning the decoded dataframe from S3
+    :param directory: where the local copies are written
+    :return dataframe: the snapshot
+    """
+    dataframe = read_local_snapshot(name, signature, directory)
+    if dataframe is None:
+        dataframe = loader()
+        write_local_snapshot(name, signature, dataframe, directory)
+    return dataframe
+
+def read_local_snapshot(name, signature, directory=LOCAL_SNAPSHOT_DIR):
+    """
+    Memory-map the local copy of a snapshot
+    :param name: name the copy was written under
+    :param signature: ETag(s) of the source objects, must match the ones the copy was written for
+    :return dataframe: the snapshot, or None if there is no current copy
+    """
+    if signature is None:
+        return None
+
+    data_path, tag_path = _paths(name, directory)
+    try:
+        with open(tag_path) as f:
+            tag = json.load(f)
+        if tag.get("signature") != signature_digest(signature):
+            return None
+
+        #uncompressed Arrow IPC, Arrow-backed columns point straight into the mapped pages
+        source = pa.memory_map(data_path, 'r')
+        dataframe = pa.ipc.open_file(source).read_all().to_pandas()
+        print("Mapped local snapshot", data_path, len(dataframe), "rows")
+        return dataframe
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print("Could not read local snapshot", data_path, e)
+        return None
+
+def write_local_snapshot(name, signature, dataframe, directory=LOCAL_SNAPSHOT_DIR):
+    """
+    Save a decoded snapshot as an Arrow IPC file tagged with the signature of its source
+    :return written: True if the copy was written
+    """
+    if signature is None:
+        return False
+
+    data_path, tag_path = _paths(name, directory)
+    temp_path = data_path + '.tmp'
+    try:
+        os.makedirs(directory, exist_ok=True)
+        table = pa.Table.from_pandas(dataframe, preserve_index=False)
+        if shutil.disk_usage(directory).free < table.nbytes * 1.1:
+            print("Not enough space in", directory, "for the local snapshot", name)
+            return False
+
+        #drop the tag first so a copy being replaced is never matched
+        if os.path.exists(tag_path):
+            os.remove(tag_path)
+        with pa.OSFile(temp_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(temp_path, data_path)
+        with open(tag_path, 'w') as f:
+            json.dump({"signature": signature_digest(signature), "rows": table.num_rows}, f)
+        print("Wrote local snapshot", data_path, f"{table.nbytes / 1e6:.1f} MB")
+        return True
+    except Exception as e:
+        print("Could not write local snapshot", data_path, e)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+
+def signature_digest(signature):
+    """
+    Stable digest of an ETag or of the signature returned by refresh.object_signature
+    """
+    return hashlib.sha256(json.dumps(signature, default=str).encode('utf-8')).hexdigest()
+
+def _paths(name, directory):
+    safe_name = ''.join(c if c.isalnum() or c in '-_.' else '_' for c in name)
+    data_path = os.path.join(directory, safe_name + '.arrow')
+    return data_path, data_path + '.json'
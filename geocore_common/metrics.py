@@ -0,0 +1,188 @@
+import os
+import json
+import time
+import functools
+import threading
+
+#Print one CloudWatch Embedded Metric Format line per invocation
+METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+METRICS_NAMESPACE = os.environ.get('METRICS_NAMESPACE', 'Geocore')
+
+class Metrics:
+    """
+    Per-invocation phase timings and counters of a lambda, printed as a single
+    CloudWatch Embedded Metric Format (EMF) log line by flush(). CloudWatch turns the
+    line into metrics under namespace, with the lambda name as the Service dimension.
+
+    Phases are timed with the span() context manager or the timed() decorator; time
+    spent in the same phase several times during an invocation is summed. When disabled,
+    span() returns a shared no-op context manager and timed() returns the function
+    unchanged, so the instrumentation can stay in place.
+
+    Values are kept per thread, so work on a background thread (a snapshot reload,
+    the cache warm-up after it) never lands in the line of the request being served.
+    Such a thread prints its own line with flush(background=True).
+    """
+    def __init__(self, service, namespace=METRICS_NAMESPACE, enabled=METRICS_ENABLED):
+        self.service = service
+        self.namespace = namespace
+        self.enabled = enabled
+        self.cold_start = True
+        self._local = threading.local()
+
+    #values of the calling thread, since its last flush
+    @property
+    def _timings(self):
+        return self._state().timings
+
+    @property
+    def _values(self):
+        return self._state().values  #name -> (value, unit)
+
+    @property
+    def _properties(self):
+        return self._state().properties
+
+    def _state(self):
+        state = self._local
+        if not hasattr(state, 'timings'):
+            state.timings, state.values, state.properties = {}, {}, {}
+        return state
+
+    def span(self, name):
+        """
+        Time the body of a with block as phase name
+        """
+        if not self.enabled:
+            return _NULL_SPAN
+        return _Span(self, name)
+
+    def timed(self, name):
+        """
+        Decorator timing every call of a function as phase name
+        """
+        def decorator(func):
+            if not self.enabled:
+                return func
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with _Span(self, name):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def add_timing(self, name, milliseconds):
+        self._timings[name] = self._timings.get(name, 0.0) + milliseconds
+
+    def count(self, name, value=1):
+        """
+        Add to a counter of the current invocation
+        """
+        if self.enabled:
+            current = self._values.get(name, (0, 'Count'))[0]
+            self._values[name] = (current + value, 'Count')
+
+    def gauge(self, name, value, unit='None'):
+        """
+        Set a metric of the current invocation, e.g. a cache hit ratio
+        """
+        if self.enabled:
+            self._values[name] = (value, unit)
+
+    def ratio(self, name, hits, misses):
+        """
+        Set name to hits / (hits + misses), nothing if there were no lookups yet
+        """
+        if self.enabled and hits + misses:
+            self._values[name] = (round(hits / (hits + misses), 4), 'None')
+
+    def property(self, name, value):
+        """
+        Add a searchable field to the log line that is not a metric, e.g. the request id
+        """
+        if self.enabled:
+            self._properties[name] = value
+
+    def handler(self, func):
+        """
+        Decorator for a lambda_handler: times the whole invocation and flushes once it returns
+        """
+        if not self.enabled:
+            return func
+
+        @functools.wraps(func)
+        def wrapper(event, context):
+            try:
+                with _Span(self, 'invocation'):
+                    return func(event, context)
+            finally:
+                self.flush()
+        return wrapper
+
+    def flush(self, background=False):
+        """
+        Print the EMF line of the invocation and reset the values for the next one
+        :param background: the line of a background thread, marked with a Background property and not counted as a cold start
+        """
+        if not self.enabled:
+            return None
+        if background and not (self._timings or self._values):
+            return None
+
+        metrics = [{"Name": name, "Unit": "Milliseconds"} for name in self._timings]
+        metrics += [{"Name": name, "Unit": unit} for name, (value, unit) in self._values.items()]
+        metrics.append({"Name": "ColdStart", "Unit": "Count"})
+
+        record = {
+            "_aws": {
+                "Timestamp": int(time.time() * 1000),
+                "CloudWatchMetrics": [{
+                    "Namespace": self.namespace,
+                    "Dimensions": [["Service"]],
+                    "Metrics": metrics
+                }]
+            },
+            "Service": self.service,
+            "ColdStart": 1 if self.cold_start and not background else 0
+        }
+        if background:
+            record["Background"] = True
+        record.update(self._properties)
+        record.update({name: round(value, 3) for name, value in self._timings.items()})
+        record.update({name: value for name, (value, unit) in self._values.items()})
+
+        line = json.dumps(record, default=str)
+        print(line)
+
+        if not background:
+            self.cold_start = False
+        state = self._state()
+        state.timings, state.values, state.properties = {}, {}, {}
+        return line
+
+class _Span:
+    __slots__ = ('metrics', 'name', 'start')
+
+    def __init__(self, metrics, name):
+        self.metrics = metrics
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.metrics.add_timing(self.name, (time.perf_counter() - self.start) * 1000)
+        return False
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return False
+
+_NULL_SPAN = _NullSpan()
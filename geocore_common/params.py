@@ -0,0 +1,12 @@
+def parse_ids(ids):
+    """
+    Accepts a list of ids or a comma separated string, returns unique ids in request order
+    """
+    if isinstance(ids, str):
+        ids = ids.split(',')
+    unique = []
+    for uuid in ids:
+        uuid = str(uuid).strip()
+        if uuid and uuid not in unique:
+            unique.append(uuid)
+    return unique
@@ -0,0 +1,127 @@
+import time
+import boto3
+import threading
+
+from urllib.parse import urlparse
+
+class SnapshotRefresher:
+    """
+    Keeps the snapshot built from the parquet objects under an S3 prefix current.
+
+    The first call to get() loads the snapshot synchronously (cold start). After that,
+    at most every check_interval_seconds, get() lists the objects under the prefix and
+    compares their ETag and LastModified with the loaded ones. When they changed, a new
+    snapshot is loaded and its indexes built on a background thread, next to the one
+    being served, and swapped in once it is complete. Requests never wait for a reload.
+    A check_interval_seconds of 0 disables the checks. on_swap, if given, is called
+    with the new snapshot after each swap, e.g. to drop responses built from the old one.
+    Requests that took the old snapshot before the swap can still be running when it is
+    called, so caches filled from a snapshot should also be keyed by it.
+    loader is called with the signature of the objects it loads (None if they could not
+    be listed), so it can reuse a local copy of the same objects. With metrics, the
+    timings recorded by a background reload and on_swap are printed as their own line.
+    """
+    def __init__(self, path, loader, check_interval_seconds=300, region=None, on_swap=None, metrics=None):
+        self.path = path
+        self.loader = loader
+        self.on_swap = on_swap
+        self.metrics = metrics
+        self.check_interval_seconds = check_interval_seconds
+        self.region = region
+        self.current = None
+        self.signature = None
+        self.refreshes = 0
+        self._checked_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def get(self):
+        """
+        Returns the current snapshot, loading it on the first call
+        """
+        if self.current is None:
+            with self._lock:
+                if self.current is None:
+                    signature = self._safe_signature()
+                    self.current = self.loader(signature)
+                    self.signature = signature
+                    self._checked_at = time.monotonic()
+            return self.current
+
+        if self.check_interval_seconds and not self._loading and \
+                time.monotonic() - self._checked_at >= self.check_interval_seconds:
+            self.check()
+        return self.current
+
+    def check(self):
+        """
+        Starts a background reload if the objects changed since the last load
+        :return changed: True if a reload was started
+        """
+        self._checked_at = time.monotonic()
+        signature = self._safe_signature()
+        if signature is None or signature == self.signature:
+            return False
+
+        with self._lock:
+            if self._loading:
+                return False
+            self._loading = True
+        print("Snapshot objects changed under", self.path, "reloading in the background")
+        threading.Thread(target=self._reload, args=(signature,), daemon=True).start()
+        return True
+
+    def reload(self):
+        """
+        Loads the snapshot again on the calling thread and swaps it in, for a request
+        that found the loaded snapshot no longer matches its objects
+        :return snapshot: the new snapshot
+        """
+        with self._lock:
+            signature = self._safe_signature()
+            snapshot = self.loader(signature)
+            self._checked_at = time.monotonic()
+        self._swap(snapshot, signature)
+        return snapshot
+
+    def _reload(self, signature):
+        try:
+            self._swap(self.loader(signature), signature)
+        except Exception as e:
+            print("Error reloading snapshot, keeping the current one:", e)
+        finally:
+            self._loading = False
+            if self.metrics:
+                self.metrics.flush(background=True)
+
+    def _swap(self, snapshot, signature):
+        #single reference assignment, requests see either the old or the new snapshot
+        self.current = snapshot
+        self.signature = signature
+        self.refreshes += 1
+        print("Snapshot swapped, refresh", self.refreshes)
+        if self.on_swap:
+            self.on_swap(snapshot)
+
+    def _safe_signature(self):
+        try:
+            return object_signature(self.path, self.region)
+        except Exception as e:
+            print("Could not list", self.path, e)
+            return None
+
+def object_signature(path, region=None):
+    """
+    Returns the (key, ETag, LastModified) of every object under an S3 path, sorted by key
+    :param path: s3://bucket/prefix
+    :param region: region of the s3 bucket
+    """
+    url = urlparse(path)
+    client = boto3.client('s3', region_name=region)
+    paginator = client.get_paginator('list_objects_v2')
+
+    signature = []
+    for page in paginator.paginate(Bucket=url.netloc, Prefix=url.path.lstrip('/')):
+        for obj in page.get("Contents", []):
+            signature.append((obj["Key"], obj["ETag"], obj["LastModified"].isoformat()))
+    return tuple(sorted(signature))
@@ -0,0 +1,172 @@
+import sys
+import itertools
+import numpy as np
+import pandas as pd
+import awswrangler as wr
+
+from geocore_common.dtypes import optimize_dtypes
+from geocore_common.local_cache import cached_dataframe
+from geocore_common.metrics import Metrics
+
+ID_COLUMN = 'features_properties_id'
+PARENT_COLUMN = 'features_properties_parentIdentifier'
+MODIFIED_COLUMN = 'features_properties_date_modified'
+SOURCE_COLUMN = 'features_properties_sourceSystemName'
+
+#stand-in for callers that do not pass their own Metrics
+_NO_METRICS = Metrics('geocore', enabled=False)
+
+def read_geocore_parquet(path, columns=None, optimize=True, date_columns=(), metrics=None):
+    """
+    Read the geocore parquet snapshot from S3 and compact its dtypes
+    :param path: S3 prefix holding the parquet file(s)
+    :param columns: only read these columns, None for all of them
+    :param optimize: convert text columns to categoricals and Arrow-backed strings
+    :param date_columns: columns parsed once to datetime64 when optimizing
+    :param metrics: Metrics of the lambda, the read and the conversion are timed as parquet_read and dtype_optimize
+    :return dataframe: the records
+    """
+    metrics = metrics or _NO_METRICS
+    with metrics.span('parquet_read'):
+        dataframe = wr.s3.read_parquet(path=path, columns=columns, pyarrow_additional_kwargs={"types_mapper": None})
+    if optimize:
+        with metrics.span('dtype_optimize'):
+            optimize_dtypes(dataframe, date_columns=date_columns)
+    return dataframe
+
+def load_geocore_snapshot(name, signature, reader, build=None, local_cache=True, metrics=None):
+    """
+    Load a snapshot from the local copy of the same source objects, or with reader, then build it
+    :param name: name of the local copy, e.g. the lambda
+    :param signature: ETag(s) of the source objects, as passed by SnapshotRefresher
+    :param reader: function returning the decoded dataframe from S3, e.g. read_geocore_parquet
+    :param build: function or GeocoreSnapshot subclass turning the dataframe into the snapshot
+    :param local_cache: keep the dataframe in /tmp for the next cold start
+    :param metrics: Metrics of the lambda, the memory of the snapshot is reported to it
+    :return snapshot: the built snapshot
+    """
+    if local_cache:
+        dataframe = cached_dataframe(name, signature, reader)
+    else:
+        dataframe = reader()
+    snapshot = (build or GeocoreSnapshot)(dataframe)
+    snapshot.report_memory(metrics)
+    return snapshot
+
+def build_id_index(dataframe):
+    """
+    Build a hash index from record id to row position for a cached snapshot
+    :param dataframe: dataframe containing all geocore records
+    :return id_index: dict mapping the string form of each id to its first row position
+    """
+    if dataframe.empty or ID_COLUMN not in dataframe.columns:
+        return {}
+
+    ids = dataframe[ID_COLUMN].astype(str).tolist()
+
+    #iterate backwards so the first occurrence of a duplicated id wins, same as .loc[[uuid]].iloc[0]
+    return dict(zip(reversed(ids), range(len(ids) - 1, -1, -1)))
+
+class lazy_index:
+    """
+    Read-only attribute computed on first access and stored on the instance, the
+    equivalent of functools.cached_property, which the python 3.7 build lacks
+    """
+    def __init__(self, build):
+        self.build = build
+        self.__doc__ = build.__doc__
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        value = self.build(instance)
+        #the instance attribute now hides this non-data descriptor
+        instance.__dict__[self.build.__name__] = value
+        return value
+
+class GeocoreSnapshot:
+    """
+    A loaded geocore parquet snapshot and its indexes. Each index is built the first time
+    it is used, or when the snapshot is built if it is listed in indexes, so a lambda only
+    pays for the ones it reads:
+
+      - id_index:        id -> first row position
+      - modified_order:  row positions sorted by date_modified, newest first, missing dates last
+      - source_index:    sourceSystemName -> row positions, newest first
+
+    It is not modified once built; a refresh builds a new snapshot and swaps it in whole.
+    """
+    def __init__(self, df, indexes=('id_index',)):
+        self.df = df
+        for name in indexes:
+            getattr(self, name)
+
+    @lazy_index
+    def id_index(self):
+        return build_id_index(self.df)
+
+    @lazy_index
+    def modified_dates(self):
+        """
+        date_modified parsed once, NaT where it is missing or not a date
+        """
+        if MODIFIED_COLUMN not in self.df.columns:
+            return pd.Series(pd.NaT, index=range(len(self.df)), dtype='datetime64[ns]')
+        return pd.to_datetime(self.df[MODIFIED_COLUMN], errors='coerce').reset_index(drop=True)
+
+    @lazy_index
+    def modified_order(self):
+        return self.modified_dates.sort_values(ascending=False, kind='stable', na_position='last').index.to_numpy()
+
+    @lazy_index
+    def source_index(self):
+        if SOURCE_COLUMN not in self.df.columns:
+            return {}
+        #group the sources in modified order, so each group keeps that order
+        sources = pd.Series(self.df[SOURCE_COLUMN].to_numpy(dtype=object)[self.modified_order])
+        return {source: self.modified_order[group] for source, group in sources.groupby(sources, sort=False).indices.items()}
+
+    def memory_usage(self):
+        """
+        Approximate bytes held by the snapshot, the dataframe and the indexes built so far
+        :return usage: dict with dataframe and indexes bytes
+        """
+        indexes = sum(_approximate_bytes(value) for name, value in vars(self).items() if name != 'df')
+        return {"dataframe": int(self.df.memory_usage(deep=True).sum()), "indexes": int(indexes)}
+
+    def report_memory(self, metrics=None):
+        """
+        Print the memory of the snapshot and set it as snapshot_dataframe_bytes and snapshot_index_bytes
+        """
+        usage = self.memory_usage()
+        print(f"Snapshot of {len(self.df)} rows: dataframe {usage['dataframe'] / 1e6:.1f} MB, indexes {usage['indexes'] / 1e6:.1f} MB")
+        if metrics is not None:
+            metrics.gauge('snapshot_dataframe_bytes', usage['dataframe'], 'Bytes')
+            metrics.gauge('snapshot_index_bytes', usage['indexes'], 'Bytes')
+        return usage
+
+#elements measured to estimate the size of a large container
+_SAMPLE_SIZE = 1000
+
+def _approximate_bytes(value, depth=2):
+    """
+    Size of an index: numpy and pandas buffers exactly, Python containers from a sample of their elements
+    """
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (pd.Series, pd.Index, pd.DataFrame)):
+        return int(np.sum(value.memory_usage(deep=True)))
+    size = sys.getsizeof(value)
+    if depth == 0:
+        return size
+    if isinstance(value, dict):
+        sample = list(itertools.islice(value.items(), _SAMPLE_SIZE))
+        sampled = sum(_approximate_bytes(key, depth - 1) + _approximate_bytes(item, depth - 1) for key, item in sample)
+    elif isinstance(value, (list, tuple, set, frozenset)):
+        sample = list(itertools.islice(value, _SAMPLE_SIZE))
+        sampled = sum(_approximate_bytes(item, depth - 1) for item in sample)
+    elif hasattr(value, '__dict__'):
+        return size + sum(_approximate_bytes(attribute, depth - 1) for attribute in vars(value).values())
+    else:
+        return size
+    return size + (sampled * len(value) // len(sample) if sample else 0)
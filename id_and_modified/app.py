@@ -1,20 +1,50 @@
+import os
 import io
 import json
 import boto3
+import functools
 import pandas as pd 
+import pyarrow.parquet as pq
 import multiprocessing
 from lambda_multiprocessing import Pool
 
+from urllib.parse import urlparse
 from botocore.exceptions import ClientError
+from geocore_common.local_cache import read_local_snapshot, write_local_snapshot
+from geocore_common.metrics import Metrics
+from geocore_common.refresh import SnapshotRefresher
+from geocore_common.snapshot import GeocoreSnapshot
 
+BUCKET_NAME = 'webpresence-geocore-geojson-to-parquet-stage'
+REGION = 'ca-central-1'
+
+#Keep the columns read from each parquet object in /tmp as an Arrow file tagged with its ETag
+LOCAL_SNAPSHOT_CACHE = os.environ.get('LOCAL_SNAPSHOT_CACHE', 'true').lower() == 'true'
+
+#Seconds between listings of the bucket for changed objects, warm containers reuse their manifest in between. 0 keeps the first manifest forever
+MANIFEST_CHECK_SECONDS = int(os.environ.get('MANIFEST_CHECK_SECONDS', 60))
+
+#Optional s3://bucket/prefix/ where the manifest of each object is written as a small parquet named after its key and ETag, for the other containers.
+#It must be in another bucket: manifests in BUCKET_NAME would be listed and read as records, and each write would trigger another reload
+MANIFEST_PATH = os.environ.get('MANIFEST_PATH', '')
+if urlparse(MANIFEST_PATH).netloc == BUCKET_NAME:
+    print("MANIFEST_PATH", MANIFEST_PATH, "is in the bucket it indexes, manifests are not shared")
+    MANIFEST_PATH = ''
+
+metrics = Metrics('id_and_modified')
+
+ID_MODIFIED_COLUMNS = ['features_properties_id', 'features_properties_date_modified', 'features_properties_sourceSystemName']
+
+#manifest of the bucket kept by warm containers: object key -> (ETag, dataframe of ID_MODIFIED_COLUMNS)
+manifest = {}
+
+@metrics.handler
 def lambda_handler(event, context):
 
     #df_parquet = read_parquet_from_s3_as_df('ca-central-1', 'webpresence-geocore-geojson-to-parquet-stage', 'records.parquet')
     #df_sentinel1 = read_parquet_from_s3_as_df('ca-central-1', 'webpresence-geocore-geojson-to-parquet-stage', 'sentinel1.parquet')
     #df_rcm = read_parquet_from_s3_as_df('ca-central-1', 'webpresence-geocore-geojson-to-parquet-stage', 'rcm-ard.parquet')
     #df = pd.concat([df_parquet, df_sentinel1, df_rcm], ignore_index=True)
-    s3_paginate_options = {'Bucket': 'webpresence-geocore-geojson-to-parquet-stage'}
-    region = 'ca-central-1'
     limit = int(event.get("limit", 10000))
     page = int(event.get("page", 1))
     source_system = event.get("source_system")
@@ -22,74 +52,187 @@ def lambda_handler(event, context):
     print(source_system)
 
     try:
-        filename_list = s3_filenames_paginated(region, **s3_paginate_options)
+        #built on cold start, later invocations reuse it until the ETag of an object changes
+        snapshot = get_manifest()
     except ClientError as e:
         print("Could not paginate the geojson bucket:", e)
         return {
             'statusCode': 500,
             'body': json.dumps({'error': str(e)})
         }
-    
-    print(filename_list)
-      
-
-    with Pool() as p:
-        # for each json file, open for reading, add to dataframe (df), close
-        # note: if there are too many records to process, we may need to paginate 
-        frames = p.map(read_parquet_from_s3_as_df, filename_list)
-
-    df = pd.concat(frames, ignore_index=True)
+    df = snapshot.df
 
     # Select only relevant columns
     if 'features_properties_id' not in df.columns or 'features_properties_date_modified' not in df.columns  or 'features_properties_sourceSystemName' not in df.columns:
-        missing = [c for c in ['features_properties_id', 'features_properties_date_modified', 'features_properties_sourceSystemName'] if c not in df.columns]
+        missing = [c for c in ID_MODIFIED_COLUMNS if c not in df.columns]
         return {
             'statusCode': 400,
             'body': json.dumps({'error': f"Missing columns: {missing}"})
         }
 
-    # Sort and select needed columns
-    df = df[['features_properties_id', 'features_properties_date_modified', 'features_properties_sourceSystemName']].sort_values(
-        by='features_properties_date_modified', ascending=False
-    )
-    df['features_properties_date_modified'] = pd.to_datetime(
-        df['features_properties_date_modified']
-    ).dt.strftime('%Y-%m-%dT%H:%M:%S')
-
-
-    if source_system:
-        if 'features_properties_sourceSystemName' not in df.columns:
-            return {
-                'statusCode': 400,
-                'body': json.dumps({'error': "Missing column: features_properties_sourceSystemName"})
-            }
-        df = df[df['features_properties_sourceSystemName'] == source_system]
+    # Row positions newest first, of one source system if requested
+    with metrics.span('sort'):
+        if source_system:
+            order = snapshot.source_index.get(source_system, snapshot.modified_order[:0])
+        else:
+            order = snapshot.modified_order
 
     # --- Pagination ---
 
     lower = max((page - 1) * limit, 0)
     upper = lower + limit
 
-    paged_df = df.iloc[lower:upper]
+    # only the rows of the page are copied and their dates formatted
+    positions = order[lower:upper]
+    paged_df = df.iloc[positions][ID_MODIFIED_COLUMNS].assign(
+        features_properties_date_modified=snapshot.modified_dates.take(positions).dt.strftime('%Y-%m-%dT%H:%M:%S').to_numpy()
+    )
     paged_df = paged_df.rename(columns={
         'features_properties_id': 'id',
         'features_properties_date_modified': 'modified',
         'features_properties_sourceSystemName': 'source'
     })
-    response_records = paged_df.to_dict(orient='records')
-
-    #print(ids_json)
-    return {
-        'statusCode': 200,
-        'body': json.dumps({
+    with metrics.span('serialize'):
+        response_records = paged_df.to_dict(orient='records')
+        body = json.dumps({
             'page': page,
             'limit': limit,
-            'total': len(df),
+            'total': len(order),
             'results': response_records
         }, default=str)
+
+    #print(ids_json)
+    return {
+        'statusCode': 200,
+        'body': body
     }
 
-def read_parquet_from_s3_as_df(s3_key):
+# Build the id/modified snapshot of the bucket, only the objects whose ETag changed are read again
+@metrics.timed('snapshot_load')
+def load_manifest(signature=None):
+    if signature is None:
+        #the refresher could not list the bucket, list it again so the error reaches the handler
+        with metrics.span('list_objects'):
+            object_list = s3_objects_paginated(REGION, Bucket=BUCKET_NAME)
+    else:
+        object_list = [(key, etag) for key, etag, last_modified in signature]
+    print("Bucket contains:", len(object_list), "files")
+
+    # unchanged objects come from the manifest in memory, then from /tmp, then from MANIFEST_PATH
+    frames = {key: manifest[key][1] for key, etag in object_list if key in manifest and manifest[key][0] == etag}
+    if LOCAL_SNAPSHOT_CACHE:
+        with metrics.span('local_snapshot_read'):
+            for key, etag in object_list:
+                if key not in frames:
+                    local_df = read_local_snapshot('id_and_modified-' + key, etag)
+                    if local_df is not None:
+                        frames[key] = local_df
+    if MANIFEST_PATH:
+        with metrics.span('manifest_read'):
+            frames.update(read_s3_manifest([(key, etag) for key, etag in object_list if key not in frames]))
+    to_download = [(key, etag) for key, etag in object_list if key not in frames]
+    metrics.gauge('objects', len(object_list), 'Count')
+    metrics.gauge('objects_read', len(to_download), 'Count')
+
+    if to_download:
+        with metrics.span('parquet_read'), Pool() as p:
+            # for each json file, open for reading, add to dataframe (df), close
+            # only the columns returned are decoded and sent back by the workers
+            fetched = p.map(functools.partial(read_parquet_from_s3_as_df, columns=ID_MODIFIED_COLUMNS), [key for key, etag in to_download])
+
+        for (key, etag), fetched_df in zip(to_download, fetched):
+            if LOCAL_SNAPSHOT_CACHE:
+                write_local_snapshot('id_and_modified-' + key, etag, fetched_df)
+            if MANIFEST_PATH:
+                write_s3_manifest(key, etag, fetched_df)
+            frames[key] = fetched_df
+
+    #objects deleted from the bucket are dropped from the manifest
+    manifest.clear()
+    manifest.update({key: (etag, frames[key]) for key, etag in object_list})
+
+    if object_list:
+        df = pd.concat([frames[key] for key, etag in object_list], ignore_index=True)
+    else:
+        df = pd.DataFrame(columns=ID_MODIFIED_COLUMNS)
+    snapshot = GeocoreSnapshot(df, indexes=('modified_order',))
+    snapshot.report_memory(metrics)
+    return snapshot
+
+refresher = SnapshotRefresher('s3://' + BUCKET_NAME + '/', load_manifest, MANIFEST_CHECK_SECONDS, REGION, metrics=metrics)
+
+# Get the current manifest, rebuilt in the background when an object of the bucket changes
+def get_manifest():
+    return refresher.get()
+
+def manifest_location():
+    """
+    Bucket and key prefix of MANIFEST_PATH, the prefix ends with / unless it is empty
+    """
+    url = urlparse(MANIFEST_PATH)
+    prefix = url.path.strip('/')
+    return url.netloc, prefix + '/' if prefix else ''
+
+def manifest_object_key(key, etag):
+    """
+    Key under MANIFEST_PATH of the manifest of one object, e.g. prefix/records.parquet.<etag>.parquet
+    """
+    return manifest_location()[1] + key + '.' + etag.strip('"') + '.parquet'
+
+def read_s3_manifest(object_list):
+    """
+    Read the manifests written under MANIFEST_PATH by other containers for the same ETags
+    :param object_list: (key, etag) of the objects missing from the local manifest
+    :return frames: dict of key -> dataframe, objects without a current manifest are left out
+    """
+    frames = {}
+    if not object_list:
+        return frames
+
+    bucket, prefix = manifest_location()
+    s3 = boto3.client('s3', region_name=REGION)
+    try:
+        available = {key for key, etag in s3_objects_paginated(REGION, Bucket=bucket, Prefix=prefix)}
+    except ClientError as e:
+        print("Could not list the manifest under", MANIFEST_PATH, e)
+        return frames
+
+    for key, etag in object_list:
+        manifest_key = manifest_object_key(key, etag)
+        if manifest_key in available:
+            try:
+                body = s3.get_object(Bucket=bucket, Key=manifest_key)['Body'].read()
+                frames[key] = pd.read_parquet(io.BytesIO(body))
+                if LOCAL_SNAPSHOT_CACHE:
+                    write_local_snapshot('id_and_modified-' + key, etag, frames[key])
+            except Exception as e:
+                print("Could not read the manifest of", key, e)
+    return frames
+
+def write_s3_manifest(key, etag, dataframe):
+    """
+    Write the manifest of one object under MANIFEST_PATH and delete the ones of its previous ETags
+    """
+    bucket = manifest_location()[0]
+    manifest_key = manifest_object_key(key, etag)
+    prefix = manifest_key[:-len(etag.strip('"') + '.parquet')]
+    s3 = boto3.client('s3', region_name=REGION)
+    try:
+        buffer = io.BytesIO()
+        dataframe.to_parquet(buffer, index=False)
+        s3.put_object(Bucket=bucket, Key=manifest_key, Body=buffer.getvalue())
+
+        #only names of the form <key>.<etag>.parquet, not the manifest of a key that starts with this one
+        stale = [
+            stale_key for stale_key, stale_etag in s3_objects_paginated(REGION, Bucket=bucket, Prefix=prefix)
+            if stale_key != manifest_key and '.' not in stale_key[len(prefix):-len('.parquet')]
+        ]
+        if stale:
+            s3.delete_objects(Bucket=bucket, Delete={'Objects': [{'Key': stale_key} for stale_key in stale]})
+    except Exception as e:
+        print("Could not write the manifest of", key, e)
+
+def read_parquet_from_s3_as_df(s3_key, columns=None):
     """
     Load a Parquet file from an S3 bucket into a pandas DataFrame.
 
@@ -97,6 +240,7 @@ def read_parquet_from_s3_as_df(s3_key):
     - region: AWS region where the S3 bucket is located.
     - s3_bucket: Name of the S3 bucket.
     - s3_key: Key (path) to the Parquet file within the S3 bucket.
+    - columns: only decode these columns, the ones missing from the file are skipped. None for all.
 
     Returns:
     - df: pandas DataFrame containing the data from the Parquet file.
@@ -110,32 +254,27 @@ def read_parquet_from_s3_as_df(s3_key):
     # Load the Parquet file as a pandas DataFrame
     object = s3.Object(s3_bucket, s3_key)
     body = object.get()['Body'].read()
-    df = pd.read_parquet(io.BytesIO(body))
+    parquet_file = pq.ParquetFile(io.BytesIO(body))
+    if columns is not None:
+        columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+    df = parquet_file.read(columns=columns).to_pandas()
     return df
 
-def s3_filenames_paginated(region, **kwargs):
-    """Paginates a S3 bucket to obtain file names. Pagination is needed as S3 returns 999 objects per request (hard limitation)
-    :param region: region of the s3 bucket 
-    :param kwargs: Must have the bucket name. For other options see the list_objects_v2 paginator: 
+def s3_objects_paginated(region, **kwargs):
+    """Paginates a S3 bucket to obtain the key and ETag of each object
+    :param region: region of the s3 bucket
+    :param kwargs: Must have the bucket name. Pagination is needed as S3 returns 1000 objects per request,
+    :              for other options see the list_objects_v2 paginator:
     :              https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/s3.html#S3.Client.list_objects_v2
-    :return: a list of filenames within the bucket
+    :return: a list of (key, etag) within the bucket
     """
     client = boto3.client('s3', region_name=region)
-    
     paginator = client.get_paginator('list_objects_v2')
-    result = paginator.paginate(**kwargs)
-    
-    filename_list = []
-    count = 0
-    
-    for page in result:
-        if "Contents" in page:
-            for key in page[ "Contents" ]:
-                keyString = key[ "Key" ]
-                #print(keyString)
-                count += 1
-                filename_list.append(keyString)
-    
-    print("Bucket contains:", count, "files")
-                
-    return filename_list
\ No newline at end of file
+
+    object_list = []
+    for page in paginator.paginate(**kwargs):
+        for obj in page.get("Contents", []):
+            object_list.append((obj["Key"], obj["ETag"]))
+
+    print("Bucket contains:", len(object_list), "files")
+    return object_list
@@ -1,6 +1,8 @@
 import os
 import json
+import time
 import boto3
+import itertools
 import logging
 import requests
 import pandas as pd
@@ -8,27 +10,90 @@ import awswrangler as wr
 
 from stats import *
 from dashboard import *
+from snapshot import *
+from records import *
+from response_cache import ResponseCache
 from datetime import datetime
 from botocore.exceptions import ClientError
+from geocore_common.refresh import SnapshotRefresher
+from geocore_common.dtypes import optimize_dtypes
+from geocore_common.snapshot import load_geocore_snapshot
+from geocore_common.metrics import Metrics
+from geocore_common.params import parse_ids
 
 PARQUET_BUCKET_NAME = os.environ['PARQUET_BUCKET_NAME']
 EXPIRY_DAYS = int(os.environ['CACHE_EXPIRY_IN_DAYS'])
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 5000))
+CACHE_MAX_BYTES = int(os.environ.get('CACHE_MAX_BYTES', 0))
+
+#Keep cached responses as "json" bytes or "zlib" compressed JSON bytes instead of dictionaries ("off")
+CACHE_CODEC = os.environ.get('CACHE_CODEC', 'off').lower()
+CACHE_COMPRESSION_LEVEL = int(os.environ.get('CACHE_COMPRESSION_LEVEL', 1))
 AOS_HOST = os.environ['OS_ENDPOINT']
 NEW_INDEX_NAME = os.environ['NEW_INDEX_NAME']
 REGION = 'ca-central-1'
 
-cache = {}
-cache_date = {}
-cache_df = pd.DataFrame()
+#Seconds between checks of the parquet objects for a new snapshot, 0 keeps the first snapshot forever
+SNAPSHOT_CHECK_SECONDS = int(os.environ.get('SNAPSHOT_CHECK_SECONDS', 300))
+
+#Convert text columns to categoricals and Arrow-backed strings at load
+OPTIMIZE_DTYPES = os.environ.get('OPTIMIZE_DTYPES', 'true').lower() == 'true'
+
+#Keep the decoded snapshot in /tmp as an Arrow file tagged with the parquet ETags, mapped on the next cold start
+LOCAL_SNAPSHOT_CACHE = os.environ.get('LOCAL_SNAPSHOT_CACHE', 'true').lower() == 'true'
+
+#Heavy columns to leave on S3 and read per row group on a cache miss, e.g. "features_geometry_coordinates,features_similarity,features_properties_eoFilters"
+DEFERRED_COLUMNS = [c.strip() for c in os.environ.get('DEFERRED_COLUMNS', '').split(',') if c.strip()]
+DEFERRED_ROW_GROUP_CACHE = int(os.environ.get('DEFERRED_ROW_GROUP_CACHE', 1))
+
+#Build every response item when the snapshot loads: "off" (build on each miss), "dict" (fastest, most memory) or "json" (serialized, less memory)
+MATERIALIZE_MODE = os.environ.get('MATERIALIZE_MODE', 'off')
+
+#Hit statistics are cached per id, and optionally loaded for every id at this interval (0 disables the table)
+STATS_CACHE_TTL_SECONDS = int(os.environ.get('STATS_CACHE_TTL_SECONDS', 300))
+STATS_TABLE_REFRESH_SECONDS = int(os.environ.get('STATS_TABLE_REFRESH_SECONDS', 0))
+
+#Maximum number of ids accepted by one batch request (?ids=X,Y,Z)
+MAX_BATCH_IDS = int(os.environ.get('MAX_BATCH_IDS', 100))
+
+#Unknown ids are remembered for this many seconds; STRICT_UUIDS rejects any id that is not a canonical UUID
+NEGATIVE_CACHE_TTL_SECONDS = int(os.environ.get('NEGATIVE_CACHE_TTL_SECONDS', 60))
+NEGATIVE_CACHE_MAX_ENTRIES = int(os.environ.get('NEGATIVE_CACHE_MAX_ENTRIES', 10000))
+STRICT_UUIDS = os.environ.get('STRICT_UUIDS', 'false').lower() == 'true'
+
+#Build the en and fr responses of the most popular records into the cache when the container starts and after each refresh
+WARM_CACHE_TOP_N = int(os.environ.get('WARM_CACHE_TOP_N', 0))
+WARM_CACHE_BUDGET_SECONDS = float(os.environ.get('WARM_CACHE_BUDGET_SECONDS', 5))
+POPULARITY_COLUMN = 'features_popularity'
+
+metrics = Metrics('id_v2')
+
+cache = ResponseCache(
+    max_entries=CACHE_MAX_ENTRIES, max_bytes=CACHE_MAX_BYTES, ttl_seconds=EXPIRY_DAYS * 86400,
+    codec=None if CACHE_CODEC == 'off' else CACHE_CODEC, compression_level=CACHE_COMPRESSION_LEVEL
+)
+negative_cache = ResponseCache(max_entries=NEGATIVE_CACHE_MAX_ENTRIES, ttl_seconds=NEGATIVE_CACHE_TTL_SECONDS)
+
+#cache keys added by warm_cache, to measure how many requests they answer
+warmed_keys = set()
 
 search_index_name = NEW_INDEX_NAME
 
+#dashboard documents of the invocation, bulk indexed when it finishes
+telemetry = TelemetryBuffer(lambda: connect_to_opensearch(REGION, AOS_HOST), search_index_name)
+stats_provider = StatsProvider(search_index_name, ttl_seconds=STATS_CACHE_TTL_SECONDS, table_refresh_seconds=STATS_TABLE_REFRESH_SECONDS)
+
+@metrics.handler
 def lambda_handler(event, context):
     """
     Parse query string parameters
     """
     
     uuid = event.get('id', False)
+    ids = event.get('ids', False)
+
+    #optional projection, e.g. fields=title_en,title_fr,published,coordinates
+    fields = parse_fields(event.get('fields'))
 
     referrer = event.get('referrer', False)
 
@@ -39,9 +104,10 @@ def lambda_handler(event, context):
     message_en = ""
     message_fr = ""
     response = uuid
-    date_time = datetime.utcnow().now()
-    cached_datetime_obj = None
     
+    if ids and lang != False:
+        return batch_lambda_handler(event, parse_ids(ids), lang, referrer, fields)
+
     if uuid == False or lang == False:
         return {
             'statusCode': 200,
@@ -49,249 +115,63 @@ def lambda_handler(event, context):
             'body': response
         }
 
-    compound_key = uuid + "_" + lang
-    cached_datetime_str = get_from_datetime_cache(compound_key)
+    #Unknown ids are answered without touching the snapshot, the response cache or OpenSearch
+    if not is_valid_id(uuid, STRICT_UUIDS):
+        metrics.count('rejected_ids')
+        return not_found_response()
+
+    #Read the parquet file on cold start, later invocations use the cached snapshot
+    #Take one reference so the whole request sees the same snapshot if a refresh swaps it
+    snapshot = get_snapshot()
+    if negative_cache.get(cache_key(uuid, generation=snapshot.generation)) != None:
+        metrics.count('negative_cache_hits')
+        return not_found_response()
+
+    compound_key = cache_key(uuid, lang, fields, snapshot.generation)
     
-    # Check to see if there is a cache hit on the datetime cache
-    if cached_datetime_str != None:
-        format_string = "%Y-%m-%d %H:%M:%S.%f"
-        cached_datetime_obj = datetime.strptime(cached_datetime_str, format_string) #convert datetime str to obj
-        
-        diff = date_time - cached_datetime_obj
-        days = diff.days #calculate the difference in days
-
-        # Compare current curr day with cached date_time
-        if days < EXPIRY_DAYS:
-            # Return the cached result and exit program
-            cached_result = get_from_cache(compound_key)
-            if cached_result != None:
-                ###
-                ### Dashboard code for cache hit
-                ###
-                event['referrer'] = referrer
-                event['cached'] = True
-                first_item = cached_result['body']['Items'][0]
-                event['title_en'] = first_item['title_en']
-                event['title_fr'] = first_item['title_fr']
-                event['organization'] = extract_org_second_segment(first_item['contact'])
-                try:
-                    os_client = connect_to_opensearch(REGION, AOS_HOST)
-                except:
-                    os_client = None
-                    print("OpenSearch client is not available. Skipping write.")
-
-                if os_client:
-                    write_to_opensearch (os_client, event, search_index_name)
-                else:
-                    print("OpenSearch is not available. Skipping write.")
-
-                return cached_result
+    # Return the cached result and exit program, expired entries are not returned
+    cached_result = get_from_cache(compound_key)
+    metrics.gauge('response_cache_hit', 1 if cached_result != None else 0)
+    if warmed_keys:
+        metrics.gauge('warm_cache_hit', 1 if cached_result != None and compound_key in warmed_keys else 0)
+    if cached_result != None:
+        ###
+        ### Dashboard code for cache hit
+        ###
+        event['referrer'] = referrer
+        event['cached'] = True
+        first_item = cached_result['body']['Items'][0]
+        event['title_en'] = first_item.get('title_en')
+        event['title_fr'] = first_item.get('title_fr')
+        event['organization'] = extract_org_second_segment(first_item.get('contact'))
+        telemetry.add(event)
+        stats_provider.record_hit(uuid)
+        finish_invocation()
+
+        return cached_result
         
     # Cache miss or a need to invalidate the cache
     if uuid != False and lang != False:
         
-        #Read the parquet file, and cache dataframe if cold start
-        geocore_df = get_df_cache()
-        if geocore_df.empty:
-            geocore_df = wr.s3.read_parquet(path=PARQUET_BUCKET_NAME, pyarrow_additional_kwargs={"types_mapper": None})
-            #print("From S3")
-            add_df_to_cache(geocore_df)
-        else:
-            print("From DF Cache")
-
-        try:
-            print(len(geocore_df))
-            #Determine if uuid exists - create index on cold start so 'id' is cached subsequently
-            geocore_df['features_properties_id'] = geocore_df['features_properties_id'].astype(str)
-            geocore_df = geocore_df.set_index('features_properties_id')
-            self_df = geocore_df.loc[[uuid]]
-            
-        except:
-            message_en += "uuid not found"
-            message_fr += "uuid introuvable"
-            return {
-                'statusCode': 200,
-                'message': nonesafe_loads('{ "message_en": "' + message_en + '", "message_fr": "' + message_fr + '" }'),
-                'body': None
-            }
+        geocore_df = snapshot.df
+
+        print(len(geocore_df))
+        #Determine if uuid exists - the id index is built once when the snapshot is loaded.
+        #A KeyError raised while building the item is a schema problem, not an unknown id
+        snapshot, items = find_current_items(snapshot, [uuid], lang, fields)
+        item = items.get(str(uuid))
+        compound_key = cache_key(uuid, lang, fields, snapshot.generation)
+        if item is None:
+            negative_cache.put(cache_key(uuid, generation=snapshot.generation), True)
+            metrics.count('unknown_ids')
+            return not_found_response()
         
-        try:
-            try:
-                id                    = uuid
-            except:
-                return {
-                    'statusCode': 200,
-                    'message': nonesafe_loads('{ "message_en": "uuid not found", "message_fr": "uuid introuvable" }'),
-                    'body': None
-                }
-            coordinates               = self_df.iloc[0]['features_geometry_coordinates']
-            title_en                  = self_df.iloc[0]['features_properties_title_en']
-            title_fr                  = self_df.iloc[0]['features_properties_title_fr']
-            published                 = self_df.iloc[0]['features_properties_date_published_date']
-            options                   = self_df.iloc[0]['features_properties_options']
-            contact                   = self_df.iloc[0]['features_properties_contact']
-            topicCategory             = self_df.iloc[0]['features_properties_topicCategory']
-            created                   = self_df.iloc[0]['features_properties_date_created_date']
-            spatialRepresentation     = self_df.iloc[0]['features_properties_spatialRepresentation']
-            hnap_type                 = self_df.iloc[0]['features_properties_type']
-            
-            try:
-                begin_temp = self_df.iloc[0]['features_properties_temporalExtent_begin']
-                if pd.isna(begin_temp):
-                    begin_temp = "None"
-            except Exception:
-                begin_temp = "None"
-
-            try:
-                end_temp = self_df.iloc[0]['features_properties_temporalExtent_end']
-                if pd.isna(end_temp):
-                    end_temp = "Present"
-            except Exception:
-                end_temp = "None"
-
-            try:
-                temporalExtent = {
-                    "begin": begin_temp,
-                    "end": end_temp
-                }
-            except Exception:
-                temporalExtent = {
-                    "begin": "0001-01-01",
-                    "end": "0001-01-01"
-                }
-            
-            #print("temporalExtent", temporalExtent)
-                
-            refSys                    = self_df.iloc[0]['features_properties_refSys']
-            refSys_version            = self_df.iloc[0]['features_properties_refSys_version']
-            status                    = self_df.iloc[0]['features_properties_status']
-            maintenance               = self_df.iloc[0]['features_properties_maintenance']
-            metadataStandard          = self_df.iloc[0]['features_properties_metadataStandard_en']
-            metadataStandardVersion   = self_df.iloc[0]['features_properties_metadataStandardVersion']
-            graphicOverview           = self_df.iloc[0]['features_properties_graphicOverview']
-            distributionFormat_name   = self_df.iloc[0]['features_properties_distributionFormat_name']
-            distributionFormat_format = self_df.iloc[0]['features_properties_distributionFormat_format']
-            accessConstraints         = self_df.iloc[0]['features_properties_accessConstraints']
-            otherConstraints          = self_df.iloc[0]['features_properties_otherConstraints_en']
-            dateStamp                 = self_df.iloc[0]['features_properties_dateStamp']
-            dataSetURI                = self_df.iloc[0]['features_properties_dataSetURI']
-            try:
-                locale                = '{"language": "' + self_df.iloc[0]['features_properties_locale_language'] + '", "country": "' + self_df.iloc[0]['features_properties_locale_country'] +  '", "encoding": "' + self_df.iloc[0]['features_properties_locale_encoding'] +  '" }'
-            except:
-                locale                = None
-            language                  = self_df.iloc[0]['features_properties_language']
-            characterSet              = self_df.iloc[0]['features_properties_characterSet']
-            environmentDescription    = self_df.iloc[0]['features_properties_environmentDescription']
-            distributionFormat_format = self_df.iloc[0]['features_properties_distributionFormat_format']
-            supplementalInformation   = self_df.iloc[0]['features_properties_supplementalInformation_en']
-            credits                   = self_df.iloc[0]['features_properties_credits']
-            cited                     = self_df.iloc[0]['features_properties_cited']
-            distributor               = self_df.iloc[0]['features_properties_distributor']
-            
-            #geocore_extensions
-            try:
-                plugins                = self_df.iloc[0]['features_properties_plugins']
-            except:
-                plugins                = None
-            
-            try:
-                sourcesystemname       = self_df.iloc[0]['features_properties_sourceSystemName']
-            except:
-                sourcesystemname       = None
-
-            #bilingual elements
-            if lang == "en":
-                description           = self_df.iloc[0]['features_properties_description_en']
-                keywords              = self_df.iloc[0]['features_properties_keywords_en']
-                useLimits             = self_df.iloc[0]['features_properties_useLimits_en']
-            elif lang == "fr":
-                description           = self_df.iloc[0]['features_properties_description_fr']
-                keywords              = self_df.iloc[0]['features_properties_keywords_fr']
-                useLimits             = self_df.iloc[0]['features_properties_useLimits_fr']
-            
-            #similarity 
-            try :
-                similarity            = self_df.iloc[0]['features_similarity']
-            except:
-                similarity            = None 
-
-            #EO collections
-            try:
-                eoCollection       = self_df.iloc[0]['features_properties_eoCollection']
-            except:
-                eoCollection       = None
-            
-            #EO collections
-            try:
-                eoFilters       = self_df.iloc[0]['features_properties_eoFilters']
-            except:
-                eoFilters       = None
-            #print(eoFilters)
-            
-            #json elements
-            contact = nonesafe_loads(contact)
-            distributor = nonesafe_loads(distributor)
-            credits = nonesafe_loads(credits)
-            cited = nonesafe_loads(cited)
-            options = nonesafe_loads(options)
-            
-            #json elements
-            locale = nonesafe_loads(locale)
-            temporalExtent = nonesafe_loads(temporalExtent)
-            graphicOverview = nonesafe_loads(graphicOverview)
-            
-            #json elements
-            similarity = nonesafe_loads(similarity)
-            
-            #json elements 
-            eoFilters = nonesafe_loads(eoFilters)
-            #body response
-            response = {"Items": [{ "id": uuid,
-                                    "coordinates": coordinates,
-                                    "title_en": title_en,
-                                    "title_fr": title_fr,
-                                    "description": description,
-                                    "published": published,
-                                    "keywords": keywords,
-                                    "topicCategory": topicCategory,
-                                    "created": created,
-                                    "spatialRepresentation": spatialRepresentation,
-                                    "type": hnap_type,
-                                    "temporalExtent": temporalExtent,
-                                    "refSys": refSys,
-                                    "refSys_version": refSys_version,
-                                    "status": status,
-                                    "maintenance": maintenance,
-                                    "metadataStandard": metadataStandard,
-                                    "metadataStandardVersion": metadataStandardVersion,
-                                    "distributionFormat_name": distributionFormat_name,
-                                    "distributionFormat_format": distributionFormat_format,
-                                    "useLimits": useLimits,
-                                    "accessConstraints": accessConstraints,
-                                    "otherConstraints": otherConstraints,
-                                    "dateStamp": dateStamp,
-                                    "dataSetURI": dataSetURI,
-                                    "locale": locale,
-                                    "language": language,
-                                    "characterSet": characterSet,
-                                    "environmentDescription": environmentDescription,
-                                    "supplementalInformation": supplementalInformation,
-                                    "graphicOverview": graphicOverview,
-                                    "contact": contact,
-                                    "distributor": distributor,
-                                    "credits": credits,
-                                    "cited": cited,
-                                    "plugins": plugins,
-                                    "options": options,
-                                    "similarity": similarity,
-                                    "sourceSystemName": sourcesystemname,
-                                    "eoCollection": eoCollection,
-                                    "eoFilters": eoFilters
-            }]};
-            
-        except ClientError as e:
-            message_en += "Error parsing parquet with id: " + uuid
-            message_fr += "Erreur d'analyse du parquet avec l'id: " + uuid
+        title_en = item.get('title_en')
+        title_fr = item.get('title_fr')
+        contact = item.get('contact')
+
+        #body response
+        response = {"Items": [item]}
         
     else:
         message_en += "id and language must be provided. Example usage: ?id=XYZ&lang=en"
@@ -308,38 +188,35 @@ def lambda_handler(event, context):
     event['title_en'] = title_en
     event['title_fr'] = title_fr
     event['organization'] = extract_org_second_segment(contact)
+    telemetry.add(event)
 
     try:
         os_client = connect_to_opensearch(REGION, AOS_HOST)
     except:
         os_client = None
-        print("OpenSearch client is not available. Skipping write.")
-
-    if os_client:
-        write_to_opensearch (os_client, event, search_index_name)
-    else:
-        print("OpenSearch is not available. Skipping write.")
+        print("OpenSearch client is not available. Skipping stats.")
 
     ###
     ### Add statistics to response
     ###
 
-    hits = get_stats(os_client, search_index_name, uuid)
+    with metrics.span('stats_query'):
+        hits = stats_provider.get(os_client, uuid)
+    stats_provider.record_hit(uuid)
     #print(hits)
 
-    response_clean = clean_na(response)
+    response_clean = response #items are cleaned by build_items
     json_message_clean = clean_na(json_message)
     
-    #Dictionary for the cache
-    json_cache = {
-        'statusCode': 200,
-        'hits': hits,
-        'message': nonesafe_loads('{ "message_en": "cached result", "message_fr": "résultat mis en cache" }'),
-        'body': response_clean
-    }
-    
-    add_to_cache(compound_key, json_cache)
-    add_to_datetime_cache(compound_key, str(date_time))
+    #Without statistics the response has zero hits and is not cached
+    if hits is None:
+        hits = {"last_30_days": 0, "all_time": 0}
+    else:
+        #Dictionary for the cache
+        json_cache = cache_entry(hits, item)
+        add_to_cache(compound_key, json_cache)
+    print("Response cache:", cache.stats())
+    finish_invocation()
     
     return {
         'statusCode': 200,
@@ -348,61 +225,299 @@ def lambda_handler(event, context):
         'body': response_clean
     }
 
-# Wrapper to safely load json objects in case it is null
-def nonesafe_loads(obj):
-    """Load JSON if string, or return None for pd.NA, np.nan, or invalid JSON."""
-    if isinstance(obj, str):
-        try:
-            val = json.loads(obj)
-            return val
-        except json.JSONDecodeError:
-            # instead of returning the raw string, treat bad JSON as None
-            return None
-    #if isinstance(obj, (pd._libs.missing.NAType, float)) and pd.isna(obj):
-    #    return None
-    return obj
-
-# Recursively replace pd.NA, np.nan with None for JSON serialization.
-def clean_na(obj):
-    """Recursively replace pd.NA, np.nan, and 'null'/'NaN' strings with None."""
-    if isinstance(obj, dict):
-        return {k: clean_na(v) for k, v in obj.items()}
-    elif isinstance(obj, list):
-        return [clean_na(x) for x in obj]
-    elif isinstance(obj, str):
-        if obj.strip().lower() in {"null", "nan", "none"}:
-            return None
-        return obj
-    elif isinstance(obj, (pd._libs.missing.NAType, float)) and pd.isna(obj):
-        return None
+def batch_lambda_handler(event, ids, lang, referrer, fields=None):
+    """
+    Return the records of several ids in one response. Ids are answered from the
+    response cache where possible, the others with one probe of the snapshot, and
+    the statistics of all ids come from one aggregated query.
+    """
+    if len(ids) > MAX_BATCH_IDS:
+        return {
+            'statusCode': 200,
+            'message': {
+                "message_en": "A maximum of " + str(MAX_BATCH_IDS) + " ids can be requested at once",
+                "message_fr": "Un maximum de " + str(MAX_BATCH_IDS) + " id peuvent être demandés à la fois"
+            },
+            'body': None
+        }
+
+    snapshot = get_snapshot()
+    items = {}
+    cached_ids = set()
+    for uuid in ids:
+        cached_result = get_from_cache(cache_key(uuid, lang, fields, snapshot.generation))
+        if cached_result != None:
+            items[uuid] = cached_result['body']['Items'][0]
+            cached_ids.add(uuid)
+
+    missing = [uuid for uuid in ids if uuid not in items and is_valid_id(uuid, STRICT_UUIDS)]
+    metrics.gauge('batch_ids', len(ids), 'Count')
+    metrics.gauge('batch_cached_ids', len(cached_ids), 'Count')
+    if missing:
+        snapshot, found_items = find_current_items(snapshot, missing, lang, fields)
+        items.update(found_items)
+
+    found = [uuid for uuid in ids if uuid in items]
+    not_found = [uuid for uuid in ids if uuid not in items]
+
+    try:
+        os_client = connect_to_opensearch(REGION, AOS_HOST)
+    except:
+        os_client = None
+        print("OpenSearch client is not available. Skipping stats.")
+    with metrics.span('stats_query'):
+        hits = stats_provider.get_many(os_client, found) if found else {}
+
+    for uuid in found:
+        item = items[uuid]
+        ###
+        ### Dashboard code, one document per record as for single id requests
+        ###
+        telemetry.add(dict(
+            event,
+            id=uuid,
+            referrer=referrer,
+            cached=uuid in cached_ids,
+            title_en=item.get('title_en'),
+            title_fr=item.get('title_fr'),
+            organization=extract_org_second_segment(item.get('contact'))
+        ))
+        stats_provider.record_hit(uuid)
+
+        #ids without statistics are answered with zero hits but not cached
+        if uuid not in hits:
+            hits[uuid] = {"last_30_days": 0, "all_time": 0}
+        elif uuid not in cached_ids:
+            add_to_cache(cache_key(uuid, lang, fields, snapshot.generation), cache_entry(hits[uuid], item))
+
+    finish_invocation()
+
+    if not_found:
+        message = {"message_en": "uuid not found: " + ", ".join(not_found), "message_fr": "uuid introuvable : " + ", ".join(not_found)}
     else:
-        return obj
+        message = {"message_en": "", "message_fr": ""}
+
+    return {
+        'statusCode': 200,
+        'hits': hits,
+        'message': message,
+        'body': {"Items": [items[uuid] for uuid in found]},
+        'not_found': not_found
+    }
+
+# Response to an id that is not in the snapshot
+def not_found_response():
+    return {
+        'statusCode': 200,
+        'message': {"message_en": "uuid not found", "message_fr": "uuid introuvable"},
+        'body': None
+    }
+
+def find_items(snapshot, uuids, lang, fields=None):
+    """
+    Build the response items of one or more ids from a snapshot
+    :param snapshot: Snapshot returned by get_snapshot
+    :param uuids: unique ids we are looking up
+    :param lang: 'en' or 'fr'
+    :param fields: projection returned by parse_fields, only the columns and JSON blobs of these fields are read
+    :return items: dictionary of id to response item, unknown ids are left out
+    """
+    #membership test on the id index, unknown ids never reach the dataframe
+    uuids = [str(uuid) for uuid in uuids if str(uuid) in snapshot.id_index]
+    if not uuids:
+        return {}
+
+    if snapshot.materialized is not None:
+        #Items were built for every record when the snapshot was loaded
+        with metrics.span('decode'):
+            items = {str(uuid): snapshot.materialized.get(uuid, lang, fields) for uuid in uuids}
+        return {uuid: item for uuid, item in items.items() if item is not None}
+
+    columns = field_columns(fields, (lang,)) if fields else None
+    with metrics.span('lookup'):
+        found, rows_df = lookup_rows(snapshot.df, snapshot.id_index, uuids, snapshot.deferred, columns)
+        values = {column: rows_df[column].tolist() for column in rows_df.columns}
+    items = {}
+    with metrics.span('decode'):
+        for position, uuid in enumerate(found):
+            record = {column: column_values[position] for column, column_values in values.items()}
+            items[uuid] = build_items(record, uuid, (lang,), fields)[lang]
+    return items
+
+def find_current_items(snapshot, uuids, lang, fields=None):
+    """
+    find_items, reloading the snapshot once if its deferred columns were rewritten since it was loaded
+    :return snapshot: the snapshot the items were built from
+    :return items: dictionary of id to response item, unknown ids are left out
+    """
+    try:
+        return snapshot, find_items(snapshot, uuids, lang, fields)
+    except StaleDeferredColumns as e:
+        print("Parquet objects changed since the snapshot was loaded, reloading:", e)
+        metrics.count('stale_deferred_reads')
+        snapshot = refresher.reload()
+        return snapshot, find_items(snapshot, uuids, lang, fields)
+
+def cache_key(uuid, lang=None, fields=None, generation=0):
+    """
+    Response cache key of a request, projected responses are cached separately.
+    Keys start with the generation of the snapshot the response was built from, so
+    a response added by a request still serving the previous snapshot is never read
+    """
+    key = str(generation) + "_" + uuid
+    if lang:
+        key += "_" + lang
+    if fields:
+        key += "_" + ",".join(fields)
+    return key
+
+# Cached response of one record
+def cache_entry(hits, item):
+    return {
+        'statusCode': 200,
+        'hits': hits,
+        'message': nonesafe_loads('{ "message_en": "cached result", "message_fr": "résultat mis en cache" }'),
+        'body': {"Items": [item]}
+    }
 
-# Function to add JSON payload to the cache
+@metrics.timed('cache_warm')
+def warm_cache(snapshot, top_n=WARM_CACHE_TOP_N, budget_seconds=WARM_CACHE_BUDGET_SECONDS):
+    """
+    Add the en and fr responses of the most popular records to the response cache
+    :param snapshot: Snapshot the responses are built from
+    :param top_n: number of records, by descending features_popularity
+    :param budget_seconds: stop adding records once this much time has been spent
+    :return count: number of records added
+    """
+    deadline = time.monotonic() + budget_seconds
+    geocore_df = snapshot.df
+    if POPULARITY_COLUMN not in geocore_df.columns:
+        print("No", POPULARITY_COLUMN, "column, the response cache is not warmed")
+        return 0
+    if cache.max_entries:
+        top_n = min(top_n, cache.max_entries // 2)
+
+    popularity = pd.to_numeric(geocore_df[POPULARITY_COLUMN], errors='coerce').reset_index(drop=True)
+    positions = popularity.nlargest(top_n).index.tolist()
+    top_ids = [uuid for uuid in geocore_df[ID_COLUMN].iloc[positions].astype(str).tolist() if is_valid_id(uuid, STRICT_UUIDS)]
+
+    #connect_to_opensearch returns None when it fails, warming without it would cache zero hits
+    os_client = connect_to_opensearch(REGION, AOS_HOST)
+    if not os_client:
+        print("OpenSearch client is not available, the response cache is not warmed")
+        return 0
+
+    count = 0
+    for start in range(0, len(top_ids), MAX_BATCH_IDS):
+        if time.monotonic() >= deadline:
+            print("Cache warm-up budget of", budget_seconds, "s reached")
+            break
+        chunk = top_ids[start:start + MAX_BATCH_IDS]
+        hits = stats_provider.get_many(os_client, chunk)
+        if len(hits) < len(chunk):
+            print("Hit statistics are not available, the response cache is not warmed further")
+            break
+        for lang in ("en", "fr"):
+            for uuid, item in find_items(snapshot, chunk, lang).items():
+                key = cache_key(uuid, lang, generation=snapshot.generation)
+                add_to_cache(key, cache_entry(hits[uuid], item))
+                warmed_keys.add(key)
+        count += len(chunk)
+
+    metrics.gauge('cache_warm_records', count, 'Count')
+    print("Warmed the response cache with", count, "popular records")
+    return count
+
+# Work deferred to the end of an invocation: the dashboard documents it queued, and the stats table when it is due
+def finish_invocation():
+    #a frozen or reclaimed container would lose documents left in the buffer, so they are written now
+    with metrics.span('opensearch_write'):
+        telemetry.flush()
+    #the table is loaded on a background thread, the invocation does not wait for it
+    if stats_provider.refresh_due():
+        stats_provider.refresh_if_due(connect_to_opensearch(REGION, AOS_HOST))
+    record_cache_metrics()
+
+# Hit ratios of the in-memory caches since the container started
+def record_cache_metrics():
+    response_stats = cache.stats()
+    metrics.ratio('response_cache_hit_ratio', response_stats['hits'], response_stats['misses'])
+    metrics.gauge('response_cache_entries', response_stats['entries'], 'Count')
+    if cache.codec:
+        metrics.gauge('response_cache_bytes', response_stats['bytes'], 'Bytes')
+    stats_cache_stats = stats_provider.cache.stats()
+    metrics.ratio('stats_cache_hit_ratio', stats_cache_stats['hits'], stats_cache_stats['misses'])
+    ip2geo_stats = ip2geo_cache.stats()
+    metrics.ratio('ip2geo_cache_hit_ratio', ip2geo_stats['hits'], ip2geo_stats['misses'])
+
+# Function to add JSON payload to the cache, expiry and eviction are handled by the cache
+@metrics.timed('cache_put')
 def add_to_cache(key, json_payload):
-    cache[key] = json_payload
+    cache.put(key, json_payload)
 
-# Function to retrieve JSON payload from the cache
+# Function to retrieve JSON payload from the cache, None if missing or expired
 def get_from_cache(key):
     return cache.get(key)
-    
-# Function to add datetime payload to the cache_date for invalidation
-def add_to_datetime_cache(key, datetime):
-    cache_date[key] = datetime
-    
-# Function to retrieve datetime payload from the cache_date for invalidation
-def get_from_datetime_cache(key):
-    return cache_date.get(key)
-
-# Add dataframe to cache
-def add_df_to_cache(dataframe):
-    global cache_df
-    cache_df = dataframe.copy()
 
-# Get dataframe to cache
-def get_df_cache():
-    global cache_df
-    return cache_df
+# Read the parquet snapshot and build its indexes, called on cold start and by the refresher
+@metrics.timed('snapshot_load')
+def load_snapshot(signature=None):
+    #deferred values are read back from the S3 objects, so only full snapshots are kept in /tmp
+    if not DEFERRED_COLUMNS:
+        return load_geocore_snapshot('id_v2', signature, read_snapshot, build_snapshot, LOCAL_SNAPSHOT_CACHE, metrics)
+    snapshot = build_snapshot(*read_deferred_snapshot())
+    snapshot.report_memory(metrics)
+    return snapshot
+
+# Read the parquet snapshot from S3 and compact its dtypes
+def read_snapshot():
+    #dates stay text, responses return them as they are written in the parquet
+    return read_geocore_parquet(PARQUET_BUCKET_NAME, optimize=OPTIMIZE_DTYPES, metrics=metrics)
+
+# Read the parquet snapshot from S3 without the deferred columns and compact its dtypes
+def read_deferred_snapshot():
+    with metrics.span('parquet_read'):
+        geocore_df, deferred = read_parquet_snapshot(PARQUET_BUCKET_NAME, REGION, DEFERRED_COLUMNS, DEFERRED_ROW_GROUP_CACHE)
+    if OPTIMIZE_DTYPES:
+        with metrics.span('dtype_optimize'):
+            optimize_dtypes(geocore_df)
+    return geocore_df, deferred
+
+# Build the id index and the optional materialized items of a dataframe
+def build_snapshot(dataframe, deferred=None):
+    generation = next(snapshot_generations)
+    materialized = None
+    if MATERIALIZE_MODE != "off":
+        if deferred is not None:
+            print("MATERIALIZE_MODE needs every column, ignored because DEFERRED_COLUMNS is set")
+        else:
+            with metrics.span('materialize'):
+                materialized = materialize_items(dataframe, MATERIALIZE_MODE)
+            print("Materialized", len(materialized), "records as", MATERIALIZE_MODE)
+    with metrics.span('index_build'):
+        return Snapshot(dataframe, deferred, materialized, generation)
+
+#numbers the snapshots built by this container, cache keys are tagged with it
+snapshot_generations = itertools.count(1)
+
+#cached responses were built from the previous snapshot, drop them when a new one is swapped in
+refresher = SnapshotRefresher(PARQUET_BUCKET_NAME, load_snapshot, SNAPSHOT_CHECK_SECONDS, REGION, on_swap=lambda snapshot: on_snapshot_swap(snapshot), metrics=metrics)
+
+# Responses and unknown ids of the previous snapshot
+def clear_caches():
+    cache.clear()
+    negative_cache.clear()
+    warmed_keys.clear()
+
+# Called by the refresher with each new snapshot
+def on_snapshot_swap(snapshot):
+    clear_caches()
+    if WARM_CACHE_TOP_N > 0:
+        warm_cache(snapshot)
+
+# Get the current snapshot, reloaded in the background when the parquet changes
+def get_snapshot():
+    return refresher.get()
 
 def extract_org_second_segment(contact_list):
     """
@@ -436,4 +551,11 @@ def extract_org_second_segment(contact_list):
 
     except Exception as e:
         print("Error in extract_org_second_segment:", e)
-        return {"en": None, "fr": None}
\ No newline at end of file
+        return {"en": None, "fr": None}
+
+#Load the snapshot and warm the cache during the init phase, so the first requests are cache hits
+if WARM_CACHE_TOP_N > 0:
+    try:
+        warm_cache(get_snapshot())
+    except Exception as e:
+        print("Could not warm the response cache:", e)
@@ -1,37 +1,88 @@
+import os
 import json
+import time
 import boto3
+import threading
+import ipaddress
 
 from botocore.exceptions import ClientError, NoCredentialsError
 from opensearchpy import OpenSearch, RequestsHttpConnection, AWSV4SignerAuth
 from requests_aws4auth import AWS4Auth
-from opensearchpy.exceptions import ConnectionError
+from opensearchpy.exceptions import ConnectionError, AuthorizationException
+from response_cache import ResponseCache
+
+OS_POOL_MAXSIZE = 10
+
+#ip2geo results are cached per ip address, or per /24 network when IP2GEO_BY_PREFIX is set
+IP2GEO_CACHE_SIZE = int(os.environ.get('IP2GEO_CACHE_SIZE', 10000))
+IP2GEO_CACHE_TTL_SECONDS = int(os.environ.get('IP2GEO_CACHE_TTL_SECONDS', 86400))
+IP2GEO_BY_PREFIX = os.environ.get('IP2GEO_BY_PREFIX', 'false').lower() == 'true'
+
+ip2geo_cache = ResponseCache(max_entries=IP2GEO_CACHE_SIZE, ttl_seconds=IP2GEO_CACHE_TTL_SECONDS)
+
+#client and index state kept for the lifetime of the container
+_os_client = None
+_os_client_key = None
+_known_indices = set()
+_client_lock = threading.Lock()
 
 def connect_to_opensearch(REGION, AOS_HOST):
-    try:        
-        credentials = boto3.Session().get_credentials()
-        if not credentials:
-            raise NoCredentialsError()
-        awsauth = AWS4Auth(credentials.access_key, credentials.secret_key, REGION, 'es', session_token=credentials.token)
-
-        os_client = OpenSearch(
-            hosts=[{'host': AOS_HOST, 'port': 443}],
-            http_auth=awsauth,
-            use_ssl=True,
-            verify_certs=True,
-            connection_class=RequestsHttpConnection
-        )
+    """
+    Returns the module-level OpenSearch client, built on first use and reused by later
+    invocations so its keep-alive connection pool survives between requests.
+    AWSV4SignerAuth reads the credentials object on every request, so temporary
+    credentials are re-signed transparently when they rotate.
+    """
+    global _os_client, _os_client_key
+    if _os_client is not None and _os_client_key == (REGION, AOS_HOST):
+        return _os_client
+
+    with _client_lock:
+        if _os_client is not None and _os_client_key == (REGION, AOS_HOST):
+            return _os_client
+        try:        
+            credentials = boto3.Session().get_credentials()
+            if not credentials:
+                raise NoCredentialsError()
+            awsauth = AWSV4SignerAuth(credentials, REGION, 'es')
+
+            os_client = OpenSearch(
+                hosts=[{'host': AOS_HOST, 'port': 443}],
+                http_auth=awsauth,
+                use_ssl=True,
+                verify_certs=True,
+                connection_class=RequestsHttpConnection,
+                pool_maxsize=OS_POOL_MAXSIZE
+            )
+        except NoCredentialsError:
+            print("Missing AWS credentials.")
+            return None
+        except ConnectionError as e:
+            print(f"Failed to connect to OpenSearch: {e}")
+            return None
+        except Exception as e:
+            print(f"Unexpected error: {e}")
+            return None
+
+        _os_client = os_client
+        _os_client_key = (REGION, AOS_HOST)
         return os_client
-    except NoCredentialsError:
-        print("Missing AWS credentials.")
-        return None
-    except ConnectionError as e:
-        print(f"Failed to connect to OpenSearch: {e}")
-        return None
-    except Exception as e:
-        print(f"Unexpected error: {e}")
-        return None
 
-def write_to_opensearch(os_client, event, search_index_name):
+def reset_opensearch_client():
+    """Discard the pooled client and known indices, the next call builds a new client."""
+    global _os_client, _os_client_key
+    with _client_lock:
+        _os_client = None
+        _os_client_key = None
+        _known_indices.clear()
+
+def build_document(event):
+    """
+    Build the dashboard document of a request, without its ip2geo data
+    :param event: lambda event with the dashboard fields added by the handler
+    :return ip_address: client ip address used for the ip2geo lookup
+    :return document: document to index
+    """
     ip_address = event.get('ip_address', '') or ''
     ip_address_forward = event.get('ip_address_forward', '') or ''
     if ip_address_forward:
@@ -47,26 +98,99 @@ def write_to_opensearch(os_client, event, search_index_name):
     title_en = event.get('title_en', '') or ''
     title_fr = event.get('title_fr', '') or ''
 
-    create_opensearch_index(os_client, search_index_name)
-    ip2geo_data = {}
-    ip2geo_data = ip2geo_handler(os_client, ip_address)
-    document = [
-        {
-            "timestamp": timestamp,
-            "lang": lang,
-            "id": id,
-            "referrer": referrer,
-            "organization": org,
-            "cached": cached,
-            "title_en": title_en,
-            "title_fr": title_fr,
-            "user_agent": user_agent,
-            "http_method": http_method,
-            "ip2geo": ip2geo_data
+    document = {
+        "timestamp": timestamp,
+        "lang": lang,
+        "id": id,
+        "referrer": referrer,
+        "organization": org,
+        "cached": cached,
+        "title_en": title_en,
+        "title_fr": title_fr,
+        "user_agent": user_agent,
+        "http_method": http_method,
+        "ip2geo": {}
+    }
+    return ip_address, document
+
+class TelemetryBuffer:
+    """
+    Holds the dashboard documents of the current invocation, one for a single id and
+    one per record for a batch request, and indexes them with one _bulk request when
+    the handler calls flush at the end of the invocation. Nothing is kept between
+    invocations. Documents are still indexed, without ip2geo data, if geolocation fails.
+    """
+    def __init__(self, client_factory, index_name):
+        self.client_factory = client_factory
+        self.index_name = index_name
+        self.queued = 0
+        self.flushed = 0
+        self.failed = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+
+    def add(self, event):
+        """
+        Queue the dashboard document of a request
+        """
+        entry = build_document(event)
+        with self._lock:
+            self._buffer.append(entry)
+            self.queued += 1
+
+    def flush(self):
+        """
+        Index every queued document in one _bulk request
+        :return count: number of documents indexed
+        """
+        with self._lock:
+            entries = self._buffer
+            self._buffer = []
+        if not entries:
+            return 0
+
+        try:
+            os_client = self.client_factory()
+        except Exception as e:
+            print("OpenSearch client is not available:", e)
+            os_client = None
+        if not os_client:
+            self.failed += len(entries)
+            print("OpenSearch is not available. Dropped", len(entries), "dashboard documents.")
+            return 0
+
+        try:
+            create_opensearch_index(os_client, self.index_name)
+            try:
+                ip2geo = ip2geo_lookup(os_client, [ip_address for ip_address, document in entries])
+            except Exception as e:
+                #a geolocation outage should not lose the hits themselves
+                print("Error in ip2geo lookup, indexing the documents without it:", e)
+                ip2geo = {}
+            documents = []
+            for ip_address, document in entries:
+                document["ip2geo"] = ip2geo.get(ip_address, {})
+                documents.append(document)
+            errors = bulk_save_to_opensearch(os_client, self.index_name, documents)
+        except Exception as e:
+            print("Error flushing dashboard documents:", e)
+            if isinstance(e, AuthorizationException):
+                reset_opensearch_client() #credentials were replaced, sign the next flush with a new session
+            self.failed += len(entries)
+            return 0
+
+        self.failed += errors
+        self.flushed += len(entries) - errors
+        print("Flushed", len(entries) - errors, "dashboard documents,", self.stats())
+        return len(entries) - errors
+
+    def stats(self):
+        return {
+            "buffered": len(self._buffer),
+            "queued": self.queued,
+            "flushed": self.flushed,
+            "failed": self.failed
         }
-    ]    
-    print(f"Document to be indexed: {document}")    
-    save_to_opensearch(os_client, search_index_name, document)
 
 def parse_geo_point(ip2geo_data):
     if 'location' in ip2geo_data and isinstance(ip2geo_data['location'], str):
@@ -78,39 +202,85 @@ def parse_geo_point(ip2geo_data):
             ip2geo_data['location'] = None  # Handle errors gracefully
     return ip2geo_data
 
-def ip2geo_handler(os_client, ip_address):
-    
-    ip2geo_payload = {
-        "docs": [
-            {
-                "_index": "test",
-                "_id": "1",
-                "_source": {
-                    "ip": ip_address
+def ip2geo_key(ip_address):
+    """Cache key of an ip address, its /24 (IPv4) or /64 (IPv6) network if IP2GEO_BY_PREFIX is set."""
+    if not IP2GEO_BY_PREFIX:
+        return ip_address
+    try:
+        ip = ipaddress.ip_address(ip_address)
+    except ValueError:
+        return ip_address
+    prefix = 24 if ip.version == 4 else 64
+    return str(ipaddress.ip_network(f"{ip_address}/{prefix}", strict=False))
+
+def ip2geo_lookup(os_client, ip_addresses):
+    """
+    Geolocates ip addresses with the ip-to-geo ingest pipeline. Addresses already in
+    ip2geo_cache are answered locally; the others are resolved with a single _simulate
+    request carrying one doc per address.
+    :param os_client: OpenSearch client
+    :param ip_addresses: iterable of ip addresses, duplicates are looked up once
+    :return ip2geo: dictionary of ip address to ip2geo data ({} if unknown)
+    """
+    ip_addresses = list(ip_addresses)  #iterated again once the pending ones are resolved
+    results = {}
+    pending = {}  #cache key -> ip address sent to the pipeline, then its ip2geo data
+    for ip_address in ip_addresses:
+        if not ip_address:
+            results[ip_address] = {}
+            continue
+        key = ip2geo_key(ip_address)
+        if ip_address in results or key in pending:
+            continue
+        cached = ip2geo_cache.get(key)
+        if cached is not None:
+            results[ip_address] = cached
+        else:
+            pending.setdefault(key, ip_address)
+
+    if pending:
+        keys = list(pending)
+        ip2geo_payload = {
+            "docs": [
+                {
+                    "_index": "test",
+                    "_id": str(i),
+                    "_source": {
+                        "ip": pending[key]
+                    }
                 }
-            }
-        ]
-    }
+                for i, key in enumerate(keys)
+            ]
+        }
 
-    response = os_client.transport.perform_request(
-        method="POST",
-        url="/_ingest/pipeline/ip-to-geo-pipeline/_simulate",
-        body=json.dumps(ip2geo_payload)
-    )
+        response = os_client.transport.perform_request(
+            method="POST",
+            url="/_ingest/pipeline/ip-to-geo-pipeline/_simulate",
+            body=json.dumps(ip2geo_payload)
+        )
 
-    ip2geo_data = {}
+        docs = response.get("docs", [])
+        for i, key in enumerate(keys):
+            ip2geo_data = {}
+            try:
+                ip2geo_data = docs[i]["doc"]["_source"].get("ip2geo", {})
+                ip2geo_data = parse_geo_point(ip2geo_data) #ensure lat lon is a geo_point
+            except (KeyError, IndexError, json.JSONDecodeError) as e:
+                print("Error extracting ip2geo data:", str(e))
+            ip2geo_cache.put(key, ip2geo_data)
+            pending[key] = ip2geo_data
 
-    try:
-        ip2geo_data = response["docs"][0]["doc"]["_source"].get("ip2geo", {})
-        ip2geo_data = parse_geo_point(ip2geo_data) #ensure lat lon is a geo_point
-    except (KeyError, json.JSONDecodeError) as e:
-        print("Error extracting ip2geo data:", str(e))
-    
-    return ip2geo_data
+    for ip_address in ip_addresses:
+        if ip_address not in results:
+            results[ip_address] = pending[ip2geo_key(ip_address)]
+    return results
 
 
 def create_opensearch_index(os_client, index_name):
-    """Create a new OpenSearch index if it doesn't exist."""
+    """Create a new OpenSearch index if it doesn't exist. Indices seen once are not checked again."""
+    if index_name in _known_indices:
+        return None
+
     if not os_client.indices.exists(index=index_name):
         # Define the mapping for the new index
         index_body = {
@@ -139,15 +309,23 @@ def create_opensearch_index(os_client, index_name):
 
         response = os_client.indices.create(index=index_name, body=index_body)
         print(f"Created new OpenSearch index: {index_name}")
+        _known_indices.add(index_name)
         return response
     else:
         print(f"Index '{index_name}' already exists.")
+        _known_indices.add(index_name)
         return None
 
-def save_to_opensearch(os_client, index, document):
+def bulk_save_to_opensearch(os_client, index, documents):
     """
-    Loads the transformed log data into OpenSearch.
+    Indexes a batch of documents with a single _bulk request
+    :return errors: number of documents OpenSearch rejected
     """
-    for doc in document:
-        response = os_client.index(index=index, body=doc)
-
+    body = []
+    for doc in documents:
+        body.append({"index": {"_index": index}})
+        body.append(doc)
+    response = os_client.bulk(body=body)
+    if not response.get("errors"):
+        return 0
+    return sum(1 for item in response.get("items", []) if "error" in item.get("index", {}))
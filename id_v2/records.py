@@ -0,0 +1,264 @@
+import json
+import pandas as pd
+
+from geocore_common.snapshot import ID_COLUMN
+
+#response fields, in the order they appear in an item
+ITEM_FIELDS = [
+    "id", "coordinates", "title_en", "title_fr", "description", "published", "keywords",
+    "topicCategory", "created", "spatialRepresentation", "type", "temporalExtent", "refSys",
+    "refSys_version", "status", "maintenance", "metadataStandard", "metadataStandardVersion",
+    "distributionFormat_name", "distributionFormat_format", "useLimits", "accessConstraints",
+    "otherConstraints", "dateStamp", "dataSetURI", "locale", "language", "characterSet",
+    "environmentDescription", "supplementalInformation", "graphicOverview", "contact",
+    "distributor", "credits", "cited", "plugins", "options", "similarity", "sourceSystemName",
+    "eoCollection", "eoFilters"
+]
+
+#parquet column of each response field copied from a single column, {lang} is the requested language
+FIELD_COLUMNS = {
+    "coordinates": 'features_geometry_coordinates',
+    "title_en": 'features_properties_title_en',
+    "title_fr": 'features_properties_title_fr',
+    "description": 'features_properties_description_{lang}',
+    "published": 'features_properties_date_published_date',
+    "keywords": 'features_properties_keywords_{lang}',
+    "topicCategory": 'features_properties_topicCategory',
+    "created": 'features_properties_date_created_date',
+    "spatialRepresentation": 'features_properties_spatialRepresentation',
+    "type": 'features_properties_type',
+    "refSys": 'features_properties_refSys',
+    "refSys_version": 'features_properties_refSys_version',
+    "status": 'features_properties_status',
+    "maintenance": 'features_properties_maintenance',
+    "metadataStandard": 'features_properties_metadataStandard_en',
+    "metadataStandardVersion": 'features_properties_metadataStandardVersion',
+    "distributionFormat_name": 'features_properties_distributionFormat_name',
+    "distributionFormat_format": 'features_properties_distributionFormat_format',
+    "useLimits": 'features_properties_useLimits_{lang}',
+    "accessConstraints": 'features_properties_accessConstraints',
+    "otherConstraints": 'features_properties_otherConstraints_en',
+    "dateStamp": 'features_properties_dateStamp',
+    "dataSetURI": 'features_properties_dataSetURI',
+    "language": 'features_properties_language',
+    "characterSet": 'features_properties_characterSet',
+    "environmentDescription": 'features_properties_environmentDescription',
+    "supplementalInformation": 'features_properties_supplementalInformation_en',
+    "graphicOverview": 'features_properties_graphicOverview',
+    "contact": 'features_properties_contact',
+    "distributor": 'features_properties_distributor',
+    "credits": 'features_properties_credits',
+    "cited": 'features_properties_cited',
+    "plugins": 'features_properties_plugins',
+    "options": 'features_properties_options',
+    "similarity": 'features_similarity',
+    "sourceSystemName": 'features_properties_sourceSystemName',
+    "eoCollection": 'features_properties_eoCollection',
+    "eoFilters": 'features_properties_eoFilters'
+}
+
+#response fields built from several columns
+TEMPORAL_EXTENT_COLUMNS = ['features_properties_temporalExtent_begin', 'features_properties_temporalExtent_end']
+LOCALE_COLUMNS = ['features_properties_locale_language', 'features_properties_locale_country', 'features_properties_locale_encoding']
+
+#fields holding JSON strings decoded with nonesafe_loads
+JSON_FIELDS = {"graphicOverview", "contact", "distributor", "credits", "cited", "options", "similarity", "eoFilters"}
+
+#geocore extensions, None when the column is missing from the parquet
+OPTIONAL_FIELDS = {"plugins", "sourceSystemName", "similarity", "eoCollection", "eoFilters"}
+
+#bilingual elements
+BILINGUAL_FIELDS = {"description", "keywords", "useLimits"}
+
+MATERIALIZE_MODES = ("off", "dict", "json")
+
+def parse_fields(fields):
+    """
+    Parse the fields= projection of a request
+    :param fields: comma separated string or list of response field names
+    :return fields: tuple of known fields in item order ("id" always included), None for every field
+    """
+    if not fields:
+        return None
+    if isinstance(fields, str):
+        fields = fields.split(',')
+    requested = {str(field).strip() for field in fields}
+    projection = tuple(field for field in ITEM_FIELDS if field in requested or field == "id")
+    if len(projection) <= 1:
+        return None
+    return projection
+
+def field_columns(fields=None, langs=("en", "fr")):
+    """
+    Parquet columns needed to build the given response fields
+    :param fields: tuple returned by parse_fields, None for every field
+    :param langs: languages that will be built
+    :return columns: set of column names
+    """
+    columns = set()
+    for field in (fields or ITEM_FIELDS):
+        if field == "temporalExtent":
+            columns.update(TEMPORAL_EXTENT_COLUMNS)
+        elif field == "locale":
+            columns.update(LOCALE_COLUMNS)
+        elif field in FIELD_COLUMNS:
+            columns.update(FIELD_COLUMNS[field].format(lang=lang) for lang in langs)
+    return columns
+
+def build_items(record, uuid, langs=("en", "fr"), fields=None):
+    """
+    Build the response item of a record for one or more languages
+    :param record: mapping of parquet column to value, a dataframe row or a dict
+    :param uuid: unique id of the record
+    :param langs: languages to build, 'en' and/or 'fr'
+    :param fields: tuple returned by parse_fields, only these fields are read and decoded; None for every field
+    :return items: dictionary of language to response item, already cleaned by clean_na
+    """
+    fields = fields or ITEM_FIELDS
+
+    #fields shared by both languages are decoded and cleaned once
+    common = {}
+    for field in fields:
+        if field not in BILINGUAL_FIELDS:
+            common[field] = clean_na(field_value(record, field, uuid))
+
+    items = {}
+    for lang in langs:
+        values = dict(common)
+        for field in fields:
+            if field in BILINGUAL_FIELDS:
+                values[field] = clean_na(record[FIELD_COLUMNS[field].format(lang=lang)])
+        items[lang] = {field: values[field] for field in fields}
+    return items
+
+def field_value(record, field, uuid):
+    """
+    Value of one response field before clean_na, bilingual fields excluded
+    """
+    if field == "id":
+        return uuid
+
+    if field == "temporalExtent":
+        try:
+            begin_temp = record['features_properties_temporalExtent_begin']
+            if pd.isna(begin_temp):
+                begin_temp = "None"
+        except Exception:
+            begin_temp = "None"
+
+        try:
+            end_temp = record['features_properties_temporalExtent_end']
+            if pd.isna(end_temp):
+                end_temp = "Present"
+        except Exception:
+            end_temp = "None"
+
+        return {
+            "begin": begin_temp,
+            "end": end_temp
+        }
+
+    if field == "locale":
+        try:
+            locale = '{"language": "' + record['features_properties_locale_language'] + '", "country": "' + record['features_properties_locale_country'] +  '", "encoding": "' + record['features_properties_locale_encoding'] +  '" }'
+        except:
+            locale = None
+        return nonesafe_loads(locale)
+
+    column = FIELD_COLUMNS[field]
+    value = _optional(record, column) if field in OPTIONAL_FIELDS else record[column]
+    if field in JSON_FIELDS:
+        value = nonesafe_loads(value)
+    return value
+
+def materialize_items(dataframe, mode="dict"):
+    """
+    Build the en and fr response items of every record in one pass over the columns
+    :param dataframe: dataframe containing all geocore records
+    :param mode: 'dict' keeps the items as dictionaries (fastest lookups, most memory),
+                 'json' keeps them as UTF-8 JSON bytes decoded on lookup (less memory)
+    :return store: MaterializedItems keyed by record id
+    """
+    #convert each column to a list once instead of boxing a row Series per record
+    columns = {column: dataframe[column].tolist() for column in dataframe.columns}
+
+    store = MaterializedItems(mode)
+    ids = [str(value) for value in columns[ID_COLUMN]]
+    for position, uuid in enumerate(ids):
+        if uuid in store:
+            continue #first occurrence of a duplicated id wins, same as the id index
+        record = {column: values[position] for column, values in columns.items()}
+        store.add(uuid, build_items(record, uuid))
+    return store
+
+class MaterializedItems:
+    """
+    Compact id -> response item store built by materialize_items
+    """
+    def __init__(self, mode="dict"):
+        if mode not in MATERIALIZE_MODES[1:]:
+            raise ValueError("Unknown materialize mode: " + str(mode))
+        self.mode = mode
+        self._items = {}
+
+    def add(self, uuid, items):
+        if self.mode == "json":
+            items = {lang: json.dumps(item, default=str).encode('utf-8') for lang, item in items.items()}
+        self._items[uuid] = items
+
+    def get(self, uuid, lang, fields=None):
+        """
+        Return the response item of a record, or None if the id is unknown
+        :param fields: tuple returned by parse_fields to project the item, None for every field
+        """
+        items = self._items.get(str(uuid))
+        if items is None:
+            return None
+        item = items[lang]
+        if self.mode == "json":
+            item = json.loads(item)
+        if fields:
+            item = {field: item[field] for field in fields}
+        return item
+
+    def __contains__(self, uuid):
+        return str(uuid) in self._items
+
+    def __len__(self):
+        return len(self._items)
+
+def _optional(record, column):
+    try:
+        return record[column]
+    except:
+        return None
+
+# Wrapper to safely load json objects in case it is null
+def nonesafe_loads(obj):
+    """Load JSON if string, or return None for pd.NA, np.nan, or invalid JSON."""
+    if isinstance(obj, str):
+        try:
+            val = json.loads(obj)
+            return val
+        except json.JSONDecodeError:
+            # instead of returning the raw string, treat bad JSON as None
+            return None
+    #if isinstance(obj, (pd._libs.missing.NAType, float)) and pd.isna(obj):
+    #    return None
+    return obj
+
+# Recursively replace pd.NA, np.nan with None for JSON serialization.
+def clean_na(obj):
+    """Recursively replace pd.NA, np.nan, and 'null'/'NaN' strings with None."""
+    if isinstance(obj, dict):
+        return {k: clean_na(v) for k, v in obj.items()}
+    elif isinstance(obj, list):
+        return [clean_na(x) for x in obj]
+    elif isinstance(obj, str):
+        if obj.strip().lower() in {"null", "nan", "none"}:
+            return None
+        return obj
+    elif isinstance(obj, (pd._libs.missing.NAType, float)) and pd.isna(obj):
+        return None
+    else:
+        return obj
@@ -0,0 +1,138 @@
+import json
+import time
+import zlib
+import threading
+
+from collections import OrderedDict
+
+#value encodings of a ResponseCache: None keeps the objects, "json" UTF-8 JSON bytes, "zlib" compressed JSON bytes
+CACHE_CODECS = (None, "json", "zlib")
+
+class ResponseCache:
+    """
+    Bounded response cache with LRU eviction and a monotonic-clock TTL.
+    Entries are evicted once either max_entries or max_bytes is exceeded;
+    a limit of 0 disables it. A ttl_seconds of None means entries never expire.
+    With a codec, values are serialized once by put() and decoded again by get(),
+    trading some CPU per hit for a much smaller footprint per entry.
+    """
+    def __init__(self, max_entries=0, max_bytes=0, ttl_seconds=None, codec=None, compression_level=1):
+        if codec not in CACHE_CODECS:
+            raise ValueError("Unknown cache codec: " + str(codec))
+        self.codec = codec
+        self.compression_level = compression_level
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.size_bytes = 0
+        self._entries = OrderedDict()  #key -> (expires_at, size, value)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+        Return the cached value for key, or None if missing or expired
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+
+            expires_at, size, value = entry
+            if expires_at is not None and time.monotonic() >= expires_at:
+                self._remove(key)
+                self.expirations += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+        return self._decode(value)
+
+    def peek(self, key):
+        """
+        Return the stored value for key without counting a hit or miss or changing its
+        LRU position, None if missing or expired. Without a codec this is the cached
+        object itself, so changes to it are seen by later get() calls
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            return None
+        return self._decode(value)
+
+    def put(self, key, value):
+        """
+        Add or replace the value for key, evicting least recently used entries if over budget
+        """
+        value = self._encode(value)
+        size = self._sizeof(value) if self.max_bytes or self.codec else 0
+        expires_at = time.monotonic() + self.ttl_seconds if self.ttl_seconds is not None else None
+
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (expires_at, size, value)
+            self.size_bytes += size
+
+            while self._entries and (
+                (self.max_entries and len(self._entries) > self.max_entries) or
+                (self.max_bytes and self.size_bytes > self.max_bytes)
+            ):
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self):
+        """
+        Return the cache counters as a dictionary
+        """
+        return {
+            "codec": self.codec,
+            "entries": len(self._entries),
+            "bytes": self.size_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        expires_at, size, value = self._entries.pop(key)
+        self.size_bytes -= size
+
+    def _encode(self, value):
+        if self.codec is None:
+            return value
+        data = json.dumps(value, default=str, separators=(',', ':')).encode('utf-8')
+        if self.codec == "zlib":
+            data = zlib.compress(data, self.compression_level)
+        return data
+
+    def _decode(self, data):
+        if self.codec is None:
+            return data
+        if self.codec == "zlib":
+            data = zlib.decompress(data)
+        return json.loads(data)
+
+    @staticmethod
+    def _sizeof(value):
+        if isinstance(value, (bytes, bytearray)):
+            return len(value)
+        return len(json.dumps(value, default=str))
@@ -0,0 +1,171 @@
+import re
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import awswrangler as wr
+
+from pyarrow import fs
+from collections import OrderedDict
+from geocore_common.snapshot import GeocoreSnapshot, read_geocore_parquet, build_id_index, ID_COLUMN
+
+#longest id accepted before a lookup, membership itself is checked on the id index
+MAX_ID_LENGTH = 256
+UUID_PATTERN = re.compile(r'[0-9a-fA-F]{8}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{4}-[0-9a-fA-F]{12}')
+
+def is_valid_id(uuid, strict=False):
+    """
+    Cheap check of a requested id, done before any lookup. Without strict only the type
+    and length are checked, since the ids of every source system are not known in advance
+    :param uuid: requested id
+    :param strict: require the 8-4-4-4-12 hexadecimal form of a UUID
+    :return valid: False if the id cannot be in the snapshot
+    """
+    if not isinstance(uuid, str) or not 0 < len(uuid) <= MAX_ID_LENGTH:
+        return False
+    if strict:
+        return UUID_PATTERN.fullmatch(uuid) is not None
+    return True
+
+def lookup_rows(dataframe, id_index, uuids, deferred=None, columns=None):
+    """
+    Find the rows of several records with one probe of the id index and a single take
+    :param dataframe: dataframe the index was built from
+    :param id_index: dict returned by build_id_index
+    :param uuids: unique ids we are looking up
+    :param deferred: DeferredColumns of the snapshot, if heavy columns were left out at load
+    :param columns: only return these columns (and only fetch these deferred columns), None for all
+    :return found: the ids that exist, as strings, in request order
+    :return rows_df: dataframe with the rows of the found ids, in the same order
+    """
+    found = [str(uuid) for uuid in uuids if str(uuid) in id_index]
+    positions = [id_index[uuid] for uuid in found]
+    if columns is None:
+        rows_df = dataframe.iloc[positions]
+    else:
+        column_positions = [i for i, column in enumerate(dataframe.columns) if column in columns]
+        rows_df = dataframe.iloc[positions, column_positions]
+
+    deferred_columns = [] if deferred is None else [c for c in deferred.columns if columns is None or c in columns]
+    if deferred_columns and positions:
+        rows_df = rows_df.copy()
+        values = [deferred.fetch(position, uuid) for uuid, position in zip(found, positions)]
+        for column in deferred_columns:
+            rows_df[column] = pd.Series([value[column] for value in values], index=rows_df.index, dtype=object)
+    return found, rows_df
+
+def read_parquet_snapshot(path, region, deferred_columns=(), max_row_groups=1):
+    """
+    Read the geocore parquet snapshot, optionally leaving heavy columns on S3
+    :param path: S3 prefix holding the parquet file(s)
+    :param region: region of the s3 bucket
+    :param deferred_columns: columns to skip at load and read per row group on demand
+    :param max_row_groups: number of decoded row groups of deferred columns kept in memory
+    :return dataframe: the records without the deferred columns
+    :return deferred: DeferredColumns to fetch the skipped values, or None if nothing was deferred
+    """
+    if not deferred_columns:
+        return read_geocore_parquet(path, optimize=False), None
+
+    filesystem = fs.S3FileSystem(region=region)
+    file_list = [key.replace('s3://', '', 1) for key in wr.s3.list_objects(path)]
+
+    frames = []
+    file_columns = []
+    row_file = []
+    row_group = []
+    row_offset = []
+    for file_number, file_path in enumerate(file_list):
+        parquet_file = pq.ParquetFile(filesystem.open_input_file(file_path))
+        names = parquet_file.schema_arrow.names
+        file_columns.append([c for c in deferred_columns if c in names])
+        frames.append(parquet_file.read(columns=[c for c in names if c not in deferred_columns]).to_pandas())
+
+        #remember where every row lives so a deferred value is a single row group read
+        for group_number in range(parquet_file.num_row_groups):
+            num_rows = parquet_file.metadata.row_group(group_number).num_rows
+            row_file.append(np.full(num_rows, file_number, dtype=np.int32))
+            row_group.append(np.full(num_rows, group_number, dtype=np.int32))
+            row_offset.append(np.arange(num_rows, dtype=np.int64))
+
+    if not frames:
+        return pd.DataFrame(), None
+
+    dataframe = pd.concat(frames, ignore_index=True)
+    deferred = DeferredColumns(
+        filesystem, file_list, file_columns, list(deferred_columns),
+        np.concatenate(row_file), np.concatenate(row_group), np.concatenate(row_offset),
+        max_row_groups
+    )
+    print("Deferred columns", deferred.columns, "across", len(file_list), "file(s)")
+    return dataframe, deferred
+
+class StaleDeferredColumns(Exception):
+    """
+    The parquet objects no longer hold the rows recorded when the snapshot was loaded
+    """
+
+class DeferredColumns:
+    """
+    Heavy columns left out of the cached snapshot. Values are read back one parquet
+    row group at a time and the last few decoded row groups are kept in an LRU.
+    The id is read with every row group, so a row that moved because the object was
+    rewritten in place (e.g. re-sorted by popularity) raises StaleDeferredColumns
+    instead of returning the values of another record.
+    """
+    def __init__(self, filesystem, file_list, file_columns, columns, row_file, row_group, row_offset, max_row_groups=1):
+        self.filesystem = filesystem
+        self.file_list = file_list
+        self.file_columns = file_columns
+        self.columns = columns
+        self.row_file = row_file
+        self.row_group = row_group
+        self.row_offset = row_offset
+        self.max_row_groups = max_row_groups
+        self._row_groups = OrderedDict()
+
+    def fetch(self, position, uuid):
+        """
+        Return the deferred values of one snapshot row
+        :param position: row position in the snapshot dataframe
+        :param uuid: id of the record at that position, checked against the row read back
+        :return values: dict of column name to value, None for columns missing from the file
+        """
+        key = (int(self.row_file[position]), int(self.row_group[position]))
+        if not self.file_columns[key[0]]:
+            return {column: None for column in self.columns}
+
+        frame = self._row_groups.get(key)
+        if frame is None:
+            frame = self._read_row_group(*key)
+            if self.max_row_groups > 0:
+                self._row_groups[key] = frame
+                while len(self._row_groups) > self.max_row_groups:
+                    self._row_groups.popitem(last=False)
+        else:
+            self._row_groups.move_to_end(key)
+
+        offset = int(self.row_offset[position])
+        if offset >= len(frame) or str(frame[ID_COLUMN].iat[offset]) != str(uuid):
+            self._row_groups.clear()
+            raise StaleDeferredColumns(self.file_list[key[0]] + " no longer has " + str(uuid) + " in row group " + str(key[1]))
+        row = frame.iloc[offset]
+        return {column: (row[column] if column in frame.columns else None) for column in self.columns}
+
+    def _read_row_group(self, file_number, group_number):
+        columns = self.file_columns[file_number] + [ID_COLUMN]
+        parquet_file = pq.ParquetFile(self.filesystem.open_input_file(self.file_list[file_number]))
+        if group_number >= parquet_file.num_row_groups:
+            raise StaleDeferredColumns(self.file_list[file_number] + " no longer has row group " + str(group_number))
+        return parquet_file.read_row_group(group_number, columns=columns).to_pandas()
+
+class Snapshot(GeocoreSnapshot):
+    """
+    A loaded parquet snapshot with its id index, the deferred columns left on S3
+    and the materialized response items, if any. generation numbers the snapshots
+    loaded by the container, responses cached from it are tagged with it
+    """
+    def __init__(self, df, deferred=None, materialized=None, generation=0):
+        super().__init__(df)
+        self.deferred = deferred
+        self.materialized = materialized
+        self.generation = generation
@@ -1,8 +1,11 @@
 import os
+import time
 import boto3
+import threading
 import requests
 from requests_aws4auth import AWS4Auth
 from datetime import datetime, timedelta
+from response_cache import ResponseCache
 
 def get_stats(os_client, index, target_id):
     """
@@ -12,7 +15,7 @@ def get_stats(os_client, index, target_id):
       - all time
     
     Uses the _msearch functionality to reduce latency by running both queries in one request.
-    Always returns integers (0 on error or no hits).. which should have been caught earlier
+    Returns 0 for an id without hits, and None if the search failed (e.g. no client), like get_stats_batch.
     """
     now = datetime.utcnow()
     thirty_days_ago = now - timedelta(days=30)
@@ -65,5 +68,228 @@ def get_stats(os_client, index, target_id):
         hits["all_time"] = res["responses"][1].get("hits", {}).get("total", {}).get("value", 0)
     except Exception as e:
         print("Error in msearch:", e)
+        return None
 
-    return hits
\ No newline at end of file
+    return hits
+
+def get_stats_batch(os_client, index, target_ids):
+    """
+    Returns {id: {"last_30_days": int, "all_time": int}} for several ids.
+
+    One search filters on all the ids and counts them with a terms aggregation, with a
+    last 30 days filter sub-aggregation, instead of one _msearch per id.
+    Ids without hits get 0. Returns None if the search failed, so callers do not
+    mistake an unavailable OpenSearch for records that were never viewed.
+    """
+    now = datetime.utcnow()
+    thirty_days_ago = now - timedelta(days=30)
+
+    body = {
+        "size": 0,
+        "query": {
+            "bool": {
+                "filter": [
+                    {"terms": {"id": list(target_ids)}}
+                ]
+            }
+        },
+        "aggs": {
+            "ids": {
+                "terms": {"field": "id", "size": max(len(target_ids), 1)},
+                "aggs": {
+                    "last_30_days": {
+                        "filter": {
+                            "range": {
+                                "timestamp": {
+                                    "gte": thirty_days_ago.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                                    "lte": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                                    "format": "strict_date_optional_time"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    hits = {target_id: {"last_30_days": 0, "all_time": 0} for target_id in target_ids}
+    try:
+        res = os_client.search(index=index, body=body)
+        for bucket in res["aggregations"]["ids"]["buckets"]:
+            hits[bucket["key"]] = {
+                "last_30_days": bucket["last_30_days"]["doc_count"],
+                "all_time": bucket["doc_count"]
+            }
+    except Exception as e:
+        print("Error in batch stats search:", e)
+        return None
+
+    return hits
+
+class StatsProvider:
+    """
+    Serves get_stats results from memory.
+
+    Every id is cached for ttl_seconds after it is fetched with get_stats. When
+    table_refresh_seconds is set, the 30-day and all-time counts of every id are
+    also loaded with one paginated terms (composite) aggregation and reloaded at
+    that interval; ids are then answered from the table without querying OpenSearch.
+    record_hit bumps the local counts so they stay current between refreshes.
+    The table is loaded on a background thread, requests keep using the per-id
+    cache (or the previous table) until it is ready.
+    """
+    def __init__(self, index, ttl_seconds=300, table_refresh_seconds=0, max_entries=10000):
+        self.index = index
+        self.table_refresh_seconds = table_refresh_seconds
+        self.cache = ResponseCache(max_entries=max_entries, ttl_seconds=ttl_seconds)
+        self.table = None
+        self.table_loaded_at = None
+        self._loading = False
+        self._lock = threading.Lock()
+
+    def get(self, os_client, target_id):
+        """
+        Returns {"last_30_days": int, "all_time": int} for target_id, or None if
+        get_stats failed, in which case nothing is cached
+        """
+        if self.table is not None:
+            return dict(self.table.get(target_id, {"last_30_days": 0, "all_time": 0}))
+
+        hits = self.cache.get(target_id)
+        if hits is None:
+            hits = get_stats(os_client, self.index, target_id)
+            if hits is None:
+                return None
+            self.cache.put(target_id, hits)
+        return dict(hits)
+
+    def get_many(self, os_client, target_ids):
+        """
+        Returns {id: {"last_30_days": int, "all_time": int}}, ids missing from the cache
+        are fetched together with get_stats_batch. If that search fails they are left
+        out of the result and nothing is cached for them.
+        """
+        if self.table is not None:
+            return {target_id: self.get(os_client, target_id) for target_id in target_ids}
+
+        results = {}
+        missing = []
+        for target_id in target_ids:
+            hits = self.cache.get(target_id)
+            if hits is None:
+                missing.append(target_id)
+            else:
+                results[target_id] = dict(hits)
+
+        if missing:
+            fetched = get_stats_batch(os_client, self.index, missing)
+            if fetched is None:
+                return results
+            for target_id, hits in fetched.items():
+                self.cache.put(target_id, hits)
+                results[target_id] = dict(hits)
+        return results
+
+    def record_hit(self, target_id):
+        """
+        Counts a hit that is being written to the dashboard index. The counts are
+        incremented in place on the dict held by the stats cache or the table, without
+        resetting its TTL. This is only safe because get and get_many return copies,
+        so responses built from them are not changed.
+        """
+        if self.table is not None:
+            hits = self.table.setdefault(target_id, {"last_30_days": 0, "all_time": 0})
+        else:
+            #peek, so the hit ratio of the stats cache only counts the lookups of get and get_many
+            hits = self.cache.peek(target_id)
+        if hits is not None:
+            hits["last_30_days"] += 1
+            hits["all_time"] += 1
+
+    def refresh_due(self):
+        if not self.table_refresh_seconds:
+            return False
+        return self.table_loaded_at is None or time.monotonic() - self.table_loaded_at >= self.table_refresh_seconds
+
+    def refresh_if_due(self, os_client):
+        """
+        Starts a background reload of the table if it is due
+        :return started: True if a reload was started
+        """
+        if not os_client or not self.refresh_due():
+            return False
+        with self._lock:
+            if self._loading:
+                return False
+            self._loading = True
+        threading.Thread(target=self._refresh_in_background, args=(os_client,), daemon=True).start()
+        return True
+
+    def _refresh_in_background(self, os_client):
+        try:
+            self.refresh(os_client)
+        finally:
+            self._loading = False
+
+    def refresh(self, os_client):
+        """
+        Reloads the per-id table, the previous table is kept if the aggregation fails
+        """
+        try:
+            self.table = get_all_stats(os_client, self.index)
+            print("Loaded hit statistics for", len(self.table), "ids")
+        except Exception as e:
+            print("Error loading hit statistics:", e)
+        self.table_loaded_at = time.monotonic()
+
+def get_all_stats(os_client, index, page_size=10000):
+    """
+    Returns the hits of every id in the index as {id: {"last_30_days": int, "all_time": int}}
+
+    Uses a composite aggregation on id with a last 30 days filter sub-aggregation,
+    paginated with after_key so high cardinality indices are fully covered.
+    """
+    now = datetime.utcnow()
+    thirty_days_ago = now - timedelta(days=30)
+
+    composite = {
+        "size": page_size,
+        "sources": [{"id": {"terms": {"field": "id"}}}]
+    }
+    body = {
+        "size": 0,
+        "aggs": {
+            "ids": {
+                "composite": composite,
+                "aggs": {
+                    "last_30_days": {
+                        "filter": {
+                            "range": {
+                                "timestamp": {
+                                    "gte": thirty_days_ago.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                                    "lte": now.strftime("%Y-%m-%dT%H:%M:%S.%fZ"),
+                                    "format": "strict_date_optional_time"
+                                }
+                            }
+                        }
+                    }
+                }
+            }
+        }
+    }
+
+    table = {}
+    while True:
+        res = os_client.search(index=index, body=body)
+        ids = res["aggregations"]["ids"]
+        for bucket in ids["buckets"]:
+            table[bucket["key"]["id"]] = {
+                "last_30_days": bucket["last_30_days"]["doc_count"],
+                "all_time": bucket["doc_count"]
+            }
+        if not ids["buckets"] or "after_key" not in ids:
+            break
+        composite["after"] = ids["after_key"]
+
+    return table
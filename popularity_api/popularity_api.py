@@ -10,6 +10,7 @@ from uuid import UUID
 from botocore.exceptions import ClientError
 from boto3.dynamodb.conditions import Key
 from decimal import Decimal
+from geocore_common.metrics import Metrics
 
 GEOJSON_BUCKET_NAME        = os.environ['GEOJSON_BUCKET_NAME']
 GEONETWORK_POPULARITY_PATH = os.environ['GEONETWORK_POPULARITY_PATH']
@@ -17,6 +18,8 @@ DYNAMODB_TABLE             = os.environ['DYNAMODB_TABLE']
 PARQUET_BUCKET_NAME        = os.environ['PARQUET_BUCKET_NAME']
 region                     = "ca-central-1"
 
+metrics = Metrics('popularity_api')
+
 """SAMPLE JSON TEST
 {
     "queryStringParameters":
@@ -44,6 +47,7 @@ region                     = "ca-central-1"
 }
 """
 
+@metrics.handler
 def lambda_handler(event, context):
     
     """PROD SETTINGS"""
@@ -148,7 +152,8 @@ def lambda_handler(event, context):
         pass
     elif operation == "update_parquet":
         try:
-            geocore_df = wr.s3.read_parquet(path=PARQUET_BUCKET_NAME)
+            with metrics.span('parquet_read'):
+                geocore_df = wr.s3.read_parquet(path=PARQUET_BUCKET_NAME)
         except ClientError as e:
             message += "Error accessing " + PARQUET_BUCKET_NAME
             print(message)
@@ -159,7 +164,8 @@ def lambda_handler(event, context):
 
         #list all files in the s3 bucket
         try:
-            filename_list = s3_filenames_paginated(region, **s3_paginate_options)
+            with metrics.span('list_objects'):
+                filename_list = s3_filenames_paginated(region, **s3_paginate_options)
         except ClientError as e:
             print("Could not paginate the geojson bucket: %s" % e)
             
@@ -167,20 +173,22 @@ def lambda_handler(event, context):
         popularity = 0
         uuid_list = []
         popularity_list = []
-        for uuid in filename_list:
-            uuid = uuid.replace('.geojson', '')
-            
-            try:
-                result = read_uuid_popularity(uuid, popularity_table, dynamodb=None)
-                result = replace_decimals_dynamodb(result)
-                popularity = result[0]['popularity']
-            except IndexError as e:
-                print ("Note:", uuid, "not found.. assigning popularity to zero")
-                popularity = 0
-            
-            #print(uuid, " ", popularity)
-            popularity_list.append(int(popularity))
-            uuid_list.append(uuid)
+        with metrics.span('dynamodb_read'):
+            for uuid in filename_list:
+                uuid = uuid.replace('.geojson', '')
+                
+                try:
+                    result = read_uuid_popularity(uuid, popularity_table, dynamodb=None)
+                    result = replace_decimals_dynamodb(result)
+                    popularity = result[0]['popularity']
+                except IndexError as e:
+                    print ("Note:", uuid, "not found.. assigning popularity to zero")
+                    popularity = 0
+                
+                #print(uuid, " ", popularity)
+                popularity_list.append(int(popularity))
+                uuid_list.append(uuid)
+        metrics.gauge('records', len(uuid_list), 'Count')
 
         #create a dataframe with uuid_list and popularity_list
         popularity_df = pd.DataFrame({'features_properties_id': uuid_list, 'features_popularity': popularity_list})
@@ -190,8 +198,9 @@ def lambda_handler(event, context):
             geocore_df = geocore_df.drop('features_popularity', 1)
 
         #merge popularity_df with geocore_df based on uuid and then sort by popularity
-        geocore_final_df = pd.merge(geocore_df, popularity_df, on='features_properties_id')
-        geocore_final_df = geocore_final_df.sort_values(by=['features_popularity'], ascending=False)
+        with metrics.span('merge'):
+            geocore_final_df = pd.merge(geocore_df, popularity_df, on='features_properties_id')
+            geocore_final_df = geocore_final_df.sort_values(by=['features_popularity'], ascending=False)
         
         """start debug block"""
         print("Processed ", len(geocore_final_df.index), "uuids")
@@ -202,11 +211,12 @@ def lambda_handler(event, context):
         parquet_filename = "records.parquet"
         try:
             print("Trying to write to the S3 bucket: " + PARQUET_BUCKET_NAME + parquet_filename)
-            wr.s3.to_parquet(
-                df=geocore_final_df,
-                path=PARQUET_BUCKET_NAME + parquet_filename,
-                dataset=False
-            )
+            with metrics.span('parquet_write'):
+                wr.s3.to_parquet(
+                    df=geocore_final_df,
+                    path=PARQUET_BUCKET_NAME + parquet_filename,
+                    dataset=False
+                )
         except ClientError as e:
             print("Could not upload the parquet file: %s" % e)
     
@@ -0,0 +1,6 @@
+import os
+import sys
+
+#the lambdas import their modules by file name, as they do once packaged
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [REPO_DIR, os.path.join(REPO_DIR, 'collections'), os.path.join(REPO_DIR, 'id_v2')]
@@ -0,0 +1,56 @@
+import itertools
+import pandas as pd
+import pytest
+
+from hierarchy import Hierarchy
+
+#parent p has children with tied titles and a duplicated id, q has one child, r none
+ROWS = [
+    ('p', None, 'Parent', 'Parent'),
+    ('a', 'p', 'Beta', 'Delta'),
+    ('b', 'p', 'Alpha', 'Alpha'),
+    ('c', 'p', 'Beta', 'Gamma'),
+    ('d', 'p', 'Zulu', 'Beta'),
+    ('c', 'p', 'Echo', 'Echo'),
+    ('e', 'p', 'Alpha', 'Zulu'),
+    ('q', 'p', 'Kilo', 'Kilo'),
+    ('f', 'q', 'Only', 'Seul'),
+    ('r', None, 'Alone', 'Seul'),
+]
+
+@pytest.fixture(scope='module')
+def hierarchy():
+    return Hierarchy(pd.DataFrame(ROWS, columns=[
+        'features_properties_id', 'features_properties_parentIdentifier',
+        'features_properties_title_en', 'features_properties_title_fr'
+    ]))
+
+# Children of a parent as the previous implementation listed them: sorted() by title, reverse, ties in row order
+def expected_children(parent_id, lang, exclude=None):
+    title = 2 if lang == 'en' else 3
+    rows = [(position, row) for position, row in enumerate(ROWS) if row[1] == parent_id and row[0] != exclude]
+    return [position for position, row in sorted(rows, key=lambda item: item[1][title], reverse=True)]
+
+@pytest.mark.parametrize('parent_id', ['p', 'q', 'r', 'unknown'])
+@pytest.mark.parametrize('lang', ['en', 'fr'])
+@pytest.mark.parametrize('exclude', [None, 'a', 'b', 'c', 'd', 'e', 'q', 'f', 'unknown'])
+def test_child_page_matches_the_sorted_list(hierarchy, parent_id, lang, exclude):
+    children = expected_children(parent_id, lang, exclude)
+    assert hierarchy.child_page(parent_id, lang, exclude=exclude) == (children, len(children))
+    for offset, limit in itertools.product(range(len(children) + 2), [0, 1, 2, 3, len(children) + 1]):
+        page, total = hierarchy.child_page(parent_id, lang, offset, limit, exclude)
+        assert page == children[offset:offset + limit], (offset, limit)
+        assert total == len(children)
+
+def test_pages_cover_every_child_once(hierarchy):
+    children = expected_children('p', 'en', exclude='c')
+    pages = [hierarchy.child_page('p', 'en', offset, 2, exclude='c')[0] for offset in range(0, len(children), 2)]
+    assert list(itertools.chain.from_iterable(pages)) == children
+
+def test_negative_offset_and_limit_are_empty_or_clamped(hierarchy):
+    children = expected_children('p', 'en')
+    assert hierarchy.child_page('p', 'en', offset=-3, limit=2)[0] == children[:2]
+    assert hierarchy.child_page('p', 'en', offset=0, limit=-1)[0] == []
+
+def test_lang_other_than_en_sorts_by_the_french_title(hierarchy):
+    assert hierarchy.child_page('p', 'de') == hierarchy.child_page('p', 'fr')
@@ -0,0 +1,69 @@
+import json
+import pytest
+
+import dashboard
+from response_cache import ResponseCache
+
+# OpenSearch client whose ingest pipeline answers with the ip it was sent as the country
+class FakeClient:
+    def __init__(self):
+        self.transport = self
+        self.requests = []
+
+    def perform_request(self, method, url, body):
+        docs = json.loads(body)['docs']
+        self.requests.append([doc['_source']['ip'] for doc in docs])
+        return {"docs": [
+            {"doc": {"_source": {"ip": doc['_source']['ip'], "ip2geo": {
+                "country_name": doc['_source']['ip'], "location": "45.4,-75.7"
+            }}}}
+            for doc in docs
+        ]}
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(dashboard, 'ip2geo_cache', ResponseCache(max_entries=100))
+    return FakeClient()
+
+@pytest.fixture
+def by_prefix(monkeypatch):
+    monkeypatch.setattr(dashboard, 'IP2GEO_BY_PREFIX', True)
+
+def test_same_network_is_sent_once(client, by_prefix):
+    ip2geo = dashboard.ip2geo_lookup(client, ['10.0.0.1', '10.0.0.2', '10.0.1.1'])
+    assert client.requests == [['10.0.0.1', '10.0.1.1']]
+    assert ip2geo['10.0.0.1'] is ip2geo['10.0.0.2']
+    assert ip2geo['10.0.0.2']['country_name'] == '10.0.0.1'
+    assert ip2geo['10.0.1.1']['country_name'] == '10.0.1.1'
+    assert ip2geo['10.0.0.1']['location'] == {"lat": 45.4, "lon": -75.7}
+
+def test_ipv6_networks_are_64_bits(client, by_prefix):
+    ip2geo = dashboard.ip2geo_lookup(client, ['2001:db8::1', '2001:db8::ffff:1', '2001:db8:0:1::1'])
+    assert client.requests == [['2001:db8::1', '2001:db8:0:1::1']]
+    assert set(ip2geo) == {'2001:db8::1', '2001:db8::ffff:1', '2001:db8:0:1::1'}
+
+def test_cached_network_is_not_sent_again(client, by_prefix):
+    dashboard.ip2geo_lookup(client, ['10.0.0.1'])
+    ip2geo = dashboard.ip2geo_lookup(client, ['10.0.0.200', '192.168.0.1'])
+    assert client.requests == [['10.0.0.1'], ['192.168.0.1']]
+    assert ip2geo['10.0.0.200']['country_name'] == '10.0.0.1'
+
+def test_without_prefix_each_address_is_sent(client):
+    ip2geo = dashboard.ip2geo_lookup(client, ['10.0.0.1', '10.0.0.2', '10.0.0.1'])
+    assert client.requests == [['10.0.0.1', '10.0.0.2']]
+    assert ip2geo['10.0.0.2']['country_name'] == '10.0.0.2'
+    dashboard.ip2geo_lookup(client, ['10.0.0.2'])
+    assert len(client.requests) == 1
+
+def test_empty_and_invalid_addresses(client, by_prefix):
+    ip2geo = dashboard.ip2geo_lookup(client, ['', None, 'not an ip'])
+    assert ip2geo[''] == {} and ip2geo[None] == {}
+    assert client.requests == [['not an ip']]
+
+def test_generator_of_addresses(client, by_prefix):
+    ip2geo = dashboard.ip2geo_lookup(client, (ip for ip in ['10.0.0.1', '10.0.0.2']))
+    assert set(ip2geo) == {'10.0.0.1', '10.0.0.2'}
+
+def test_missing_docs_are_cached_as_unknown(client, monkeypatch):
+    monkeypatch.setattr(client, 'perform_request', lambda method, url, body: {"docs": []})
+    assert dashboard.ip2geo_lookup(client, ['10.0.0.1']) == {'10.0.0.1': {}}
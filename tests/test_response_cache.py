@@ -0,0 +1,126 @@
+import pytest
+
+import response_cache
+from response_cache import ResponseCache
+
+# Monotonic clock of the cache, moved forward by the tests
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(response_cache.time, 'monotonic', clock)
+    return clock
+
+def test_evicts_the_least_recently_used_entry_over_max_entries():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1  #b is now the least recently used
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert (cache.get('a'), cache.get('c')) == (1, 3)
+    assert len(cache) == 2
+    assert cache.evictions == 1
+
+def test_replacing_a_key_does_not_evict():
+    cache = ResponseCache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    cache.put('a', 10)
+    assert (cache.get('a'), cache.get('b')) == (10, 2)
+    assert cache.evictions == 0
+
+@pytest.mark.parametrize('codec', [None, 'json', 'zlib'])
+def test_evicts_over_max_bytes(codec):
+    value = {'id': 'x' * 100}
+    size = ResponseCache(codec=codec)._sizeof(ResponseCache(codec=codec)._encode(value))
+    cache = ResponseCache(max_bytes=2 * size, codec=codec)
+    for key in 'abc':
+        cache.put(key, value)
+    assert len(cache) == 2
+    assert cache.size_bytes == 2 * size
+    assert cache.get('a') is None
+    assert cache.get('c') == value
+
+def test_entry_larger_than_max_bytes_is_not_kept():
+    cache = ResponseCache(max_bytes=10)
+    cache.put('a', 'x' * 100)
+    assert len(cache) == 0
+    assert cache.size_bytes == 0
+
+def test_entries_expire_after_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put('a', 1)
+    clock.now += 59.9
+    assert cache.get('a') == 1
+    clock.now += 0.1
+    assert cache.get('a') is None
+    assert cache.expirations == 1
+    assert len(cache) == 0
+
+def test_no_ttl_never_expires(clock):
+    cache = ResponseCache()
+    cache.put('a', 1)
+    clock.now += 10 ** 9
+    assert cache.get('a') == 1
+
+def test_put_restarts_the_ttl(clock):
+    cache = ResponseCache(ttl_seconds=60)
+    cache.put('a', 1)
+    clock.now += 50
+    cache.put('a', 2)
+    clock.now += 50
+    assert cache.get('a') == 2
+
+def test_peek_does_not_count_or_reorder(clock):
+    cache = ResponseCache(max_entries=2, ttl_seconds=60)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.peek('a') == 1
+    assert cache.peek('missing') is None
+    assert (cache.hits, cache.misses) == (0, 0)
+    cache.put('c', 3)  #a was only peeked, so it is still the oldest
+    assert cache.peek('a') is None
+    clock.now += 60
+    assert cache.peek('b') is None
+    assert cache.expirations == 0
+
+def test_get_counts_hits_and_misses():
+    cache = ResponseCache()
+    cache.put('a', 1)
+    cache.get('a')
+    cache.get('a')
+    cache.get('b')
+    assert cache.stats() == {
+        'codec': None, 'entries': 1, 'bytes': 0,
+        'hits': 2, 'misses': 1, 'evictions': 0, 'expirations': 0
+    }
+
+@pytest.mark.parametrize('codec', ['json', 'zlib'])
+def test_codec_round_trips_and_copies(codec):
+    cache = ResponseCache(codec=codec)
+    value = {'statusCode': 200, 'body': [{'id': 'a', 'title': 'é'}]}
+    cache.put('a', value)
+    first = cache.get('a')
+    assert first == value
+    first['body'].append('changed')
+    assert cache.get('a') == value
+    assert cache.size_bytes > 0
+
+def test_unknown_codec():
+    with pytest.raises(ValueError):
+        ResponseCache(codec='gzip')
+
+def test_clear():
+    cache = ResponseCache(max_bytes=1000)
+    cache.put('a', 1)
+    cache.clear()
+    assert len(cache) == 0
+    assert cache.size_bytes == 0
+    assert cache.get('a') is None